@@ -0,0 +1,104 @@
+# --- キャッシュ層の共通部品 ---
+# geocoding / forecast_cache / parking_index / search / uploads で共有します。
+#   - LRUCache: 有効期限付きの LRU キャッシュ
+#   - normalize_place_name: 地名・検索クエリのキャッシュキーの正規化
+#   - SingleFlight: 同じキーの同時リクエストを1つのタスクにまとめる
+import asyncio
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_place_name(name: str) -> str:
+    """全角/半角・大文字小文字・空白の違いを吸収したキャッシュキーを返す。"""
+    name = unicodedata.normalize("NFKC", name)
+    return " ".join(name.split()).casefold()
+
+
+class LRUCache:
+    """有効期限付きの LRU キャッシュ。"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        """(hit, value) を返す。値として None もキャッシュできるようにタプルで返す。"""
+        item = self._data.get(key)
+        if item is None:
+            return False, None
+        value, expires_at = item
+        if expires_at <= time.time():
+            del self._data[key]
+            return False, None
+        self._data.move_to_end(key)
+        return True, value
+
+    def set(self, key, value, expires_at: float) -> None:
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SingleFlight:
+    """キーごとに実行中のタスクを1つだけ持つ。
+
+    処理は独立したタスクで行うので、最初の呼び出し元が切断しても同じキーを待つ他の呼び出し元は影響を受けない。
+    呼び出し元は返されたタスクを asyncio.shield で包んで待つ。
+    呼び出しごとにイベントループを作り直す環境では、前のループに残ったタスクは待てないので無視して作り直す。
+    on_error を渡すと、失敗したタスクのキーと例外で呼び出す (待っている側がいない場合のログ用)。
+    """
+
+    def __init__(self, on_error=None):
+        self._tasks: dict = {}
+        self._on_error = on_error
+
+    def get(self, key) -> asyncio.Task | None:
+        task = self._tasks.get(key)
+        if task is not None and task.get_loop() is not asyncio.get_running_loop():
+            # 閉じたループでは完了のコールバックも呼ばれないので、ここで外します
+            del self._tasks[key]
+            return None
+        return task
+
+    def run(self, key, factory) -> asyncio.Task:
+        """key の実行中タスクを返す。無ければ factory() のコルーチンで開始する。"""
+        task = self.get(key)
+        if task is None:
+            task = self.start([key], factory)
+        return task
+
+    def start(self, keys, factory) -> asyncio.Task:
+        """factory() のコルーチンを1つのタスクで開始し、keys のすべてに登録する。"""
+        keys = list(keys)
+        task = asyncio.create_task(factory())
+        for key in keys:
+            self._tasks[key] = task
+        task.add_done_callback(lambda t: self._finish(keys, t))
+        return task
+
+    def _finish(self, keys, task: asyncio.Task) -> None:
+        for key in keys:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+        # 待っている側がいなくても "exception was never retrieved" を出さないようにします
+        if task.cancelled() or task.exception() is None:
+            return
+        if self._on_error is not None:
+            for key in keys:
+                self._on_error(key, task.exception())
+
+    async def aclose(self) -> None:
+        loop = asyncio.get_running_loop()
+        tasks = {task for task in self._tasks.values() if task.get_loop() is loop}
+        self._tasks = {key: task for key, task in self._tasks.items() if task in tasks}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def __len__(self) -> int:
+        return len(self._tasks)
@@ -0,0 +1,101 @@
+# --- 天気予報のキャッシュ ---
+# Open-Meteo の予報を「緯度経度のグリッドセル + 期間」単位でキャッシュします。
+# 数メートルしか離れていない地点同士は同じセルになるので、同じ結果を共有できます。
+#   - 鮮度: Open-Meteo のモデル更新間隔 (既定1時間) の区切りまで有効
+#   - 期限切れ後も FORECAST_STALE_SECONDS の間は古い値を返しつつ裏で更新 (stale-while-revalidate)
+#   - 保持件数は FORECAST_CACHE_SIZE までの LRU
+import asyncio
+import logging
+import math
+import os
+import time
+
+from cache import LRUCache, SingleFlight
+from metrics import CACHE_REQUESTS, cache_result
+
+FORECAST_GRID_DEGREES = float(os.environ.get("FORECAST_GRID_DEGREES", 0.05))
+FORECAST_UPDATE_INTERVAL_SECONDS = float(os.environ.get("FORECAST_UPDATE_INTERVAL_SECONDS", 3600))
+# モデル実行の区切りから実際にAPIへ反映されるまでの遅れ
+FORECAST_PUBLISH_LAG_SECONDS = float(os.environ.get("FORECAST_PUBLISH_LAG_SECONDS", 600))
+FORECAST_STALE_SECONDS = float(os.environ.get("FORECAST_STALE_SECONDS", 6 * 3600))
+FORECAST_CACHE_SIZE = int(os.environ.get("FORECAST_CACHE_SIZE", 4096))
+
+DAILY_FIELDS = "weathercode,temperature_2m_max,temperature_2m_min,precipitation_probability_max"
+TIMEZONE = "Asia/Tokyo"
+
+
+def grid_cell(latitude: float, longitude: float, resolution: float = FORECAST_GRID_DEGREES) -> tuple[int, int]:
+    return math.floor(latitude / resolution), math.floor(longitude / resolution)
+
+
+def fresh_until(now: float, interval: float = FORECAST_UPDATE_INTERVAL_SECONDS, lag: float = FORECAST_PUBLISH_LAG_SECONDS) -> float:
+    """次のモデル更新が反映される時刻 (epoch秒) を返す。"""
+    return (math.floor((now - lag) / interval) + 1) * interval + lag
+
+
+class ForecastCache:
+    def __init__(
+        self,
+        client_factory,
+        resolution: float = FORECAST_GRID_DEGREES,
+        update_interval: float = FORECAST_UPDATE_INTERVAL_SECONDS,
+        publish_lag: float = FORECAST_PUBLISH_LAG_SECONDS,
+        stale_seconds: float = FORECAST_STALE_SECONDS,
+        maxsize: int = FORECAST_CACHE_SIZE,
+    ):
+        self._client_factory = client_factory
+        self.resolution = resolution
+        self.update_interval = update_interval
+        self.publish_lag = publish_lag
+        self.stale_seconds = stale_seconds
+        # key -> (data, fresh_until)。LRU の有効期限は古い値を返せる期間の終わりまでです
+        self._entries = LRUCache(maxsize)
+        self._inflight = SingleFlight(on_error=lambda key, e: logging.warning(f"Forecast refresh failed for {key}: {e}"))
+
+    async def get(self, latitude: float, longitude: float, start_date: str | None = None, end_date: str | None = None) -> dict:
+        """Open-Meteo /v1/forecast の daily 予報 (JSON) を返す。"""
+        cell = grid_cell(latitude, longitude, self.resolution)
+        key = (cell, start_date, end_date)
+        now = time.time()
+
+        hit, entry = self._entries.get(key)
+        if hit:
+            data, expires_at = entry
+            if now < expires_at:
+                cache_result("forecast", True)
+                return data
+            # 古い値をすぐ返し、更新は裏で行います
+            CACHE_REQUESTS.inc(cache="forecast", result="stale")
+            self._refresh(key)
+            return data
+
+        cache_result("forecast", False)
+        return await asyncio.shield(self._refresh(key))
+
+    def _refresh(self, key: tuple) -> asyncio.Task:
+        return self._inflight.run(key, lambda: self._fetch(key))
+
+    async def _fetch(self, key: tuple) -> dict:
+        (lat_index, lon_index), start_date, end_date = key
+        # セルの中心の予報を取ることで、セル内のどの地点からでも同じ結果になります
+        params = {
+            "latitude": round((lat_index + 0.5) * self.resolution, 4),
+            "longitude": round((lon_index + 0.5) * self.resolution, 4),
+            "daily": DAILY_FIELDS,
+            "timezone": TIMEZONE,
+        }
+        if start_date:
+            params["start_date"] = start_date
+        if end_date:
+            params["end_date"] = end_date
+
+        response = await self._client_factory().get("/v1/forecast", params=params)
+        response.raise_for_status()
+        data = response.json()
+
+        expires_at = fresh_until(time.time(), self.update_interval, self.publish_lag)
+        self._entries.set(key, (data, expires_at), expires_at + self.stale_seconds)
+        return data
+
+    async def aclose(self) -> None:
+        await self._inflight.aclose()
@@ -0,0 +1,228 @@
+# --- ジオコーディングのキャッシュ層 ---
+# Nominatim への問い合わせを次の順に減らします。
+#   1. プロセス内の LRU キャッシュ
+#   2. ディスク上の SQLite キャッシュ (GEOCODE_CACHE_PATH)
+#   3. 同じ地名の同時リクエストは1本の問い合わせにまとめる (single-flight)
+#   4. それでも外に出る問い合わせはトークンバケットで 1 req/s に制限
+#
+# 既定の SQLite の置き場所は一時ディレクトリです。Vercel ではインスタンスごとのディスクなので、
+# 同じインスタンスの呼び出し間でしか共有されず、コールドスタートのたびに空に戻ります。
+# コールドスタートをまたいで使うには、事前読み込みしたファイルをデプロイに含め、GEOCODE_CACHE_PATH に指定します。
+# デプロイ先のファイルは書き込めないので読み取り専用で開き、新しく調べた地名はプロセス内の LRU にだけ残ります。
+#
+# 地名リストの事前読み込み (デプロイに含める場合は vercel.json の includeFiles にも追加します):
+#   GEOCODE_TTL_SECONDS=31536000 python api/geocoding.py places.txt --db api/geocode-cache.sqlite3
+import argparse
+import asyncio
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from cache import LRUCache, SingleFlight, normalize_place_name
+from metrics import cache_result
+
+GEOCODE_CACHE_PATH = os.environ.get("GEOCODE_CACHE_PATH", os.path.join(tempfile.gettempdir(), "final-app-geocode.sqlite3"))
+GEOCODE_TTL_SECONDS = float(os.environ.get("GEOCODE_TTL_SECONDS", 30 * 24 * 3600))
+# 見つからなかった地名は表記ゆれの修正があり得るので短めに保持します
+GEOCODE_NEGATIVE_TTL_SECONDS = float(os.environ.get("GEOCODE_NEGATIVE_TTL_SECONDS", 24 * 3600))
+GEOCODE_LRU_SIZE = int(os.environ.get("GEOCODE_LRU_SIZE", 2048))
+# Nominatim の利用規約: 最大 1 req/s
+NOMINATIM_RATE_PER_SECOND = float(os.environ.get("NOMINATIM_RATE_PER_SECOND", 1.0))
+NOMINATIM_BURST = int(os.environ.get("NOMINATIM_BURST", 1))
+
+
+class TokenBucket:
+    """非同期のトークンバケット。acquire() はトークンが貯まるまで待つ。
+
+    呼び出しごとに送ってよい時刻を予約して、その時刻まで眠るだけにしています (GCRA)。
+    asyncio.Lock はイベントループに結び付くので使いません (呼び出しごとにループを作り直す環境でも動くように)。
+    待っている間にキャンセルされた呼び出しの予約はそのまま消費されます。
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        # 予約済みの最後の呼び出しの、理論上の送信時刻 + 1/rate
+        self._next = 0.0
+
+    async def acquire(self) -> None:
+        now = time.monotonic()
+        interval = 1 / self.rate
+        self._next = max(self._next, now) + interval
+        # capacity 回分までは間隔を詰めて送れます
+        delay = self._next - self.capacity * interval - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def is_read_only(path: str) -> bool:
+    """既存のファイルで、ファイルかディレクトリに書き込めなければ True。"""
+    if not os.path.exists(path):
+        return False
+    return not (os.access(path, os.W_OK) and os.access(os.path.dirname(os.path.abspath(path)), os.W_OK))
+
+
+class SQLiteStore:
+    """地名 -> 座標 の永続キャッシュ。呼び出しはスレッドプールから行う。
+
+    readonly (既定は書き込めるかどうかで判定) のときはテーブルを作らず、set() は何もしない。
+    """
+
+    def __init__(self, path: str, readonly: bool | None = None):
+        self.path = path
+        self.readonly = is_read_only(path) if readonly is None else readonly
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.readonly:
+                # 読み取り専用のファイルシステムではロック用のファイルも作れないので immutable で開きます
+                uri = f"{pathlib.Path(self.path).absolute().as_uri()}?mode=ro&immutable=1"
+                self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                return self._conn
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocode ("
+                " key TEXT PRIMARY KEY, value TEXT, expires_at REAL NOT NULL)"
+            )
+        return self._conn
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT value, expires_at FROM geocode WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] <= time.time():
+            return False, None, 0.0
+        return True, json.loads(row[0]), row[1]
+
+    def set(self, key: str, value, expires_at: float) -> None:
+        if self.readonly:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO geocode (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at),
+            )
+            conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class Geocoder:
+    """地名を {"lat", "lon"} に変換する。見つからない場合は None。"""
+
+    def __init__(
+        self,
+        client_factory,
+        store_path: str = GEOCODE_CACHE_PATH,
+        ttl: float = GEOCODE_TTL_SECONDS,
+        negative_ttl: float = GEOCODE_NEGATIVE_TTL_SECONDS,
+        lru_size: int = GEOCODE_LRU_SIZE,
+        rate: float = NOMINATIM_RATE_PER_SECOND,
+        burst: int = NOMINATIM_BURST,
+    ):
+        self._client_factory = client_factory
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lru = LRUCache(lru_size)
+        self.store = SQLiteStore(store_path)
+        self.limiter = TokenBucket(rate, burst)
+        self._inflight = SingleFlight()
+
+    async def geocode(self, name: str):
+        key = normalize_place_name(name)
+        hit, value = self.lru.get(key)
+        cache_result("geocode_memory", hit)
+        if hit:
+            return value
+
+        # 同じ地名を問い合わせ中なら、その結果を待つだけにします。
+        # 問い合わせは独立したタスクで行うので、最初の呼び出し元が切断しても他は影響を受けません。
+        return await asyncio.shield(self._inflight.run(key, lambda: self._lookup(key, name)))
+
+    async def _lookup(self, key: str, name: str):
+        try:
+            hit, value, expires_at = await asyncio.to_thread(self.store.get, key)
+        except sqlite3.Error as e:
+            logging.warning(f"Geocode store read failed: {e}")
+            hit = False
+        cache_result("geocode_store", hit)
+        if hit:
+            self.lru.set(key, value, expires_at)
+            return value
+
+        value = await self._fetch(name)
+        expires_at = time.time() + (self.ttl if value is not None else self.negative_ttl)
+        self.lru.set(key, value, expires_at)
+        try:
+            await asyncio.to_thread(self.store.set, key, value, expires_at)
+        except sqlite3.Error as e:
+            logging.warning(f"Geocode store write failed: {e}")
+        return value
+
+    async def _fetch(self, name: str):
+        await self.limiter.acquire()
+        params = {"q": f"{name}, 日本", "format": "json", "limit": 1}
+        response = await self._client_factory().get("/search", params=params)
+        response.raise_for_status()
+        geo_data = response.json()
+        if not geo_data:
+            return None
+        return {"lat": float(geo_data[0]["lat"]), "lon": float(geo_data[0]["lon"])}
+
+    async def warm(self, names) -> dict:
+        """地名リストを順に問い合わせてキャッシュに載せる。"""
+        results = {}
+        for name in names:
+            try:
+                results[name] = await self.geocode(name)
+            except Exception as e:
+                logging.warning(f"Geocode warm-up failed for {name}: {e}")
+                results[name] = None
+        return results
+
+    def close(self) -> None:
+        self.store.close()
+
+
+async def _warm_main(args) -> None:
+    from upstream import pool, get_client
+
+    names = []
+    for path in args.files:
+        with (sys.stdin if path == "-" else open(path, encoding="utf-8")) as f:
+            names.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+
+    geocoder = Geocoder(lambda: get_client("nominatim"), store_path=args.db)
+    try:
+        results = await geocoder.warm(names)
+    finally:
+        geocoder.close()
+        await pool.aclose()
+
+    found = sum(1 for value in results.values() if value is not None)
+    for name, value in results.items():
+        coords = "-" if value is None else f"{value['lat']},{value['lon']}"
+        print(f"{name}\t{coords}")
+    print(f"warmed {found}/{len(results)} places into {args.db}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="地名リストをジオコーディングキャッシュに事前読み込みします")
+    parser.add_argument("files", nargs="+", help="1行に1つの地名を書いたファイル ('-' で標準入力)")
+    parser.add_argument("--db", default=GEOCODE_CACHE_PATH, help="SQLite キャッシュのパス")
+    asyncio.run(_warm_main(parser.parse_args()))
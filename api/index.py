@@ -4,24 +4,39 @@ from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import json
 import os
+import sys
 import asyncio
-import httpx
 import urllib.parse
 import logging # Add this line
+import time
+from datetime import datetime
+from contextlib import asynccontextmanager
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-from vercel_blob import put
-from tavily import TavilyClient
-import google.generativeai as genai
 from dotenv import load_dotenv # Add this line
 
+# api/ 配下の補助モジュールを Vercel 上でも import できるようにします
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from upstream import pool as upstream_pool, get_client
+from lazy import LazyObject, loaded
+from cache import LRUCache
+from geocoding import Geocoder
+from forecast_cache import ForecastCache
+from streaming import sse_event, sse_response, stream_gemini
+from search import SearchCache, build_context, normalize_query, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL_SECONDS
+import metrics
+from metrics import MetricsMiddleware, cache_result, stage, timed
+
 load_dotenv() # Add this line
 
 # --- APIキーの設定 ---
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY") # Corrected
 TAVILY_API_KEY = os.environ.get("TAVILY_API_KEY") # Corrected
+# 接続先の差し替え (負荷試験のローカル代替など)。未設定なら本物の API に接続します
+GEMINI_API_ENDPOINT = os.environ.get("GEMINI_API_ENDPOINT")
+TAVILY_BASE_URL = os.environ.get("TAVILY_BASE_URL")
 
 if GEMINI_API_KEY:
     print("hogehoge",GEMINI_API_KEY)
@@ -34,11 +49,57 @@ if TAVILY_API_KEY:
 else:
     logging.warning("TAVILY_API_KEY not found or is empty.")
 
-genai.configure(api_key=GEMINI_API_KEY)
-tavily = TavilyClient(api_key=TAVILY_API_KEY)
-model = genai.GenerativeModel('gemini-1.5-flash')
-
-app = FastAPI()
+# 重い SDK は最初に使うときに import・初期化します (lazy.py)。
+# "/" や "/weather/" だけを処理するコールドスタートでは読み込まれません。
+def plaintext_grpc_transport(**kwargs):
+    # SDK の非同期 API は gRPC のトランスポートでしか動かない (rest では generate_content_async が使えない) ので、
+    # GEMINI_API_ENDPOINT には TLS なしの gRPC で接続します
+    import grpc
+    from google.ai.generativelanguage_v1beta.services.generative_service.transports import GenerativeServiceGrpcAsyncIOTransport
+    return GenerativeServiceGrpcAsyncIOTransport(channel=grpc.aio.insecure_channel(kwargs["host"]), **kwargs)
+
+def create_model():
+    import google.generativeai as genai
+    if GEMINI_API_ENDPOINT:
+        genai.configure(api_key=GEMINI_API_KEY, transport=plaintext_grpc_transport, client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+    else:
+        genai.configure(api_key=GEMINI_API_KEY)
+    return genai.GenerativeModel('gemini-1.5-flash')
+
+def create_tavily():
+    from tavily import AsyncTavilyClient
+    return AsyncTavilyClient(api_key=TAVILY_API_KEY, api_base_url=TAVILY_BASE_URL)
+
+def create_parking_index():
+    from parking_index import ParkingIndex
+    return ParkingIndex(lambda: get_client("overpass"))
+
+def create_uploader():
+    from uploads import Uploader
+    return Uploader()
+
+model = LazyObject(create_model)
+tavily = LazyObject(create_tavily)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await upstream_pool.start()
+    yield
+    await forecast_cache.aclose()
+    await upstream_pool.aclose()
+    geocoder.close()
+    # 使われなかった SDK をシャットダウンのためだけに読み込まないようにします
+    if loaded(uploader) is not None:
+        uploader.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+geocoder = Geocoder(lambda: get_client("nominatim"))
+forecast_cache = ForecastCache(lambda: get_client("open_meteo"))
+parking_index = LazyObject(create_parking_index)
+search_cache = SearchCache(lambda: tavily)
+answer_cache = LRUCache(SEARCH_CACHE_SIZE)
+uploader = LazyObject(create_uploader)
 
 app.add_middleware(
     CORSMiddleware,
@@ -46,42 +107,188 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # ブラウザの開発者ツールや JavaScript から Server-Timing などを読めるようにします
+    expose_headers=["Server-Timing", "X-Profile-Id"],
 )
+# 全リクエストの所要時間を記録し、Server-Timing ヘッダーを付けます (metrics.py)
+app.add_middleware(MetricsMiddleware)
 
 @app.get("/")
 def read_root():
     return {"Hello": "World"}
 
+# --- 計測機能 ---
+@app.get("/metrics")
+def get_metrics():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/debug/profile/{profile_id}")
+def get_profile(profile_id: str, request: Request):
+    # 取得にもプロファイル取得時と同じトークンを要求します
+    if not metrics.PROFILE_TOKEN or request.headers.get("x-profile") != metrics.PROFILE_TOKEN:
+        return JSONResponse(status_code=403, content={"message": "Profiling is disabled or the X-Profile token is wrong."})
+    profile = metrics.get_profile(profile_id)
+    if profile is None:
+        return JSONResponse(status_code=404, content={"message": f"Profile not found: {profile_id}"})
+    return Response(content=profile, media_type="text/plain; charset=utf-8")
+
 # --- 天気予報機能 ---
 @app.get("/weather/")
 async def get_weather(latitude: float = Query(...), longitude: float = Query(...)):
     try:
-        url = f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&daily=weathercode,temperature_2m_max,temperature_2m_min,precipitation_probability_max&timezone=Asia%2FTokyo"
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            weather_data = response.json()
-            return JSONResponse(status_code=200, content=weather_data)
+        # 近くの地点と同じグリッドセルの予報を共有します (forecast_cache.py)
+        with stage("weather"):
+            weather_data = await forecast_cache.get(latitude, longitude)
+        return JSONResponse(status_code=200, content=weather_data)
     except Exception as e:
         return JSONResponse(status_code=500, content={"message": f"An error occurred: {str(e)}"})
 
 # --- AI検索機能 ---
-@app.get("/ai-search/")
-async def ai_search(query: str = Query(...)):
-    try:
-        context = tavily.search(query=query, search_depth="advanced")
-        prompt = f"""
+def build_search_prompt(query: str, context: str) -> str:
+    return f"""
         以下の検索結果を参考にして、ユーザーの質問に日本語で分かりやすく答えてください。
         ユーザーの質問: {query}
         検索結果: {context}
         """
-        response = await model.generate_content_async(prompt)
+
+async def build_search_context(query: str) -> str:
+    # 検索結果はクエリ単位でキャッシュし、重複を除いてトークン上限内に収めます (search.py)
+    with stage("search"):
+        results = await search_cache.search(query)
+    with stage("context"):
+        return await asyncio.to_thread(build_context, results)
+
+@app.get("/ai-search/")
+async def ai_search(query: str = Query(...)):
+    try:
+        key = normalize_query(query)
+        hit, answer = answer_cache.get(key)
+        cache_result("answer", hit)
+        if hit:
+            return JSONResponse(content={"answer": answer})
+
+        prompt = build_search_prompt(query, await build_search_context(query))
+        with stage("llm"):
+            response = await model.generate_content_async(prompt)
+        answer_cache.set(key, response.text, time.time() + SEARCH_CACHE_TTL_SECONDS)
         return JSONResponse(content={"answer": response.text})
 
     except Exception as e:
         return JSONResponse(status_code=500, content={"message": f"An error occurred: {str(e)}"})
 
+# 回答を生成しながら SSE で流す版 (event: chunk ... event: done)
+@app.get("/ai-search/stream")
+async def ai_search_stream(query: str = Query(...)):
+    try:
+        key = normalize_query(query)
+        hit, answer = answer_cache.get(key)
+        cache_result("answer", hit)
+        if hit:
+            return sse_response(sse_event(answer, "chunk"), sse_event("", "done"))
+
+        prompt = build_search_prompt(query, await build_search_context(query))
+        # 最後まで生成できた回答だけを /ai-search/ と同じキャッシュに入れます
+        return sse_response(stream_gemini(
+            model, prompt,
+            on_complete=lambda text: answer_cache.set(key, text, time.time() + SEARCH_CACHE_TTL_SECONDS),
+        ))
+
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"message": f"An error occurred: {str(e)}"})
+
 # --- AI旅行プラン最適化機能 (最終決定版) ---
+async def fetch_walking_durations(coords_str: str):
+    """徒歩の所要時間行列を返す。取得できなければ None (route_optimizer が車の距離から見積もります)。"""
+    # 徒歩の OSRM は車とは別の外部サーバーなので、落ちていても旅程の作成は止めません
+    try:
+        response = await get_client("osrm_walking").get(f"/table/v1/foot/{coords_str}")
+        response.raise_for_status()
+        return response.json()['durations']
+    except Exception as e:
+        logging.warning(f"Walking matrix unavailable, estimating walking times from driving distances: {e!r}")
+        return None
+
+async def plan_itinerary(destinations: str, date: str, durations: str, start_lat: float, start_lon: float, start_time: str):
+    """スケジュールを計算して {"plan", "weather"} を返す。入力や経路に問題があれば JSONResponse を返す。"""
+    # Convert durations string to list of ints
+    durations_list = [int(d.strip()) for d in durations.split(',')]
+
+    # Convert destinations string to list of names
+    destination_names = [dest.strip() for dest in destinations.split(',')]
+
+    logging.debug(f"destinations received: '{destinations}'")
+    logging.debug(f"destination_names: {destination_names}, len: {len(destination_names)}")
+    logging.debug(f"durations received: '{durations}'")
+    logging.debug(f"durations_list: {durations_list}, len: {len(durations_list)}")
+
+    if not all([destinations, date, durations, start_lat, start_lon]): # Check for empty strings/None for required fields
+        return JSONResponse(status_code=400, content={"message": "Missing required query parameters: destinations, date, durations, start_lat, start_lon"})
+
+    if len(destination_names) != len(durations_list):
+        return JSONResponse(status_code=400, content={"message": "The number of destinations and durations must be the same."})
+
+    # 訪問順・交通手段・到着時刻は行列から計算します (route_optimizer.py, numpy は必要になるまで読み込みません)
+    from route_optimizer import build_schedule, RouteError, MAX_DESTINATIONS
+    if len(destination_names) > MAX_DESTINATIONS:
+        return JSONResponse(status_code=400, content={"message": f"Too many destinations (maximum {MAX_DESTINATIONS})."})
+
+    try:
+        start = datetime.fromisoformat(f"{date}T{start_time}")
+    except ValueError:
+        return JSONResponse(status_code=400, content={"message": "date must be YYYY-MM-DD and start_time must be HH:MM."})
+
+    locations = [{"name": "現在地", "lat": start_lat, "lon": start_lon}]
+
+    # キャッシュ済みの地名は Nominatim に問い合わせません (geocoding.py)
+    with stage("geocode"):
+        geocoded = await asyncio.gather(*(geocoder.geocode(name) for name in destination_names))
+
+    for i, coords in enumerate(geocoded):
+        if coords is None:
+            return JSONResponse(status_code=404, content={"message": f"目的地が見つかりませんでした: {destination_names[i]}"})
+
+        locations.append({"name": destination_names[i], "lat": coords["lat"], "lon": coords["lon"]})
+
+    first_dest = locations[1]
+
+    coords_str = ";".join([f"{loc['lon']},{loc['lat']}" for loc in locations])
+
+    # 天気と経路行列は並行して取得し、それぞれを段階として計測します。
+    # 車の距離は、徒歩の行列が使えないときに徒歩の所要時間を見積もるのに使います
+    weather_task = timed("weather", forecast_cache.get(first_dest['lat'], first_dest['lon'], start_date=date, end_date=date))
+    osrm_driving_task = timed("matrix", get_client("osrm").get(f"/table/v1/driving/{coords_str}", params={"annotations": "duration,distance"}))
+    osrm_walking_task = timed("matrix", fetch_walking_durations(coords_str))
+
+    weather_forecast, osrm_driving_response, durations_walking_matrix = await asyncio.gather(weather_task, osrm_driving_task, osrm_walking_task)
+    osrm_driving_response.raise_for_status()
+
+    weather_data = weather_forecast.get('daily', {})
+    weather_info = f"天気予報: 最高気温 {weather_data.get('temperature_2m_max', ['N/A'])[0]}℃, 降水確率 {weather_data.get('precipitation_probability_max', ['N/A'])[0]}%"
+    driving_table = osrm_driving_response.json()
+    durations_driving_matrix = driving_table['durations']
+    distances_driving_matrix = driving_table.get('distances')
+
+    try:
+        # 順路の探索は CPU を使うので、イベントループを止めないよう別スレッドで行います
+        with stage("optimize"):
+            schedule = await asyncio.to_thread(
+                build_schedule, locations, durations_list, durations_driving_matrix, durations_walking_matrix, start, distances_driving_matrix,
+            )
+    except RouteError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
+
+    return {"plan": schedule, "weather": weather_info}
+
+def build_narration_prompt(schedule, weather_info: str) -> str:
+    # AIには決まったスケジュールの紹介文だけを書いてもらいます
+    return f"""
+        あなたは旅行プランナーAIです。以下の確定済みの旅行スケジュールを、旅行者向けに日本語で簡潔に紹介してください。
+        訪問順・時刻・交通手段は変更しないでください。天気に応じた服装や持ち物の注意があれば添えてください。
+
+        {weather_info}
+        スケジュール: {json.dumps(schedule, ensure_ascii=False)}
+        """
+
 @app.get("/create-itinerary/")
 async def create_itinerary(
     destinations: str = Query(...),
@@ -89,163 +296,53 @@ async def create_itinerary(
     durations: str = Query(...),
     start_lat: float = Query(...),
     start_lon: float = Query(...),
+    start_time: str = Query("09:00"),
+    narrate: bool = Query(True),
 ):
     try:
-        # Parameters are now directly available as function arguments
-        # No need for request.query_params or params.get()
-
-        # Convert durations string to list of ints
-        durations_list = [int(d.strip()) for d in durations.split(',')]
-
-        # Convert destinations string to list of names
-        destination_names = [dest.strip() for dest in destinations.split(',')]
-
-        print(f"DEBUG: destinations received: '{destinations}'") # 追加
-        print(f"DEBUG: destination_names: {destination_names}, len: {len(destination_names)}") # 追加
-        print(f"DEBUG: durations received: '{durations}'") # 追加
-        print(f"DEBUG: durations_list: {durations_list}, len: {len(durations_list)}") # 追加
-
-        if not all([destinations, date, durations, start_lat, start_lon]): # Check for empty strings/None for required fields
-            return JSONResponse(status_code=400, content={"message": "Missing required query parameters: destinations, date, durations, start_lat, start_lon"})
-
-        if len(destination_names) != len(durations_list):
-            return JSONResponse(status_code=400, content={"message": "The number of destinations and durations must be the same."})
-
-        headers = {'User-Agent': 'FinalApp/1.0 (ryo-pow)'}
-        locations = [{"name": "現在地", "lat": start_lat, "lon": start_lon}]
-        dest_details = []
-
-        
-
-        headers = {'User-Agent': 'FinalApp/1.0 (ryo-pow)'}
-        locations = [{"name": "現在地", "lat": start_lat, "lon": start_lon}]
-        dest_details = []
-
-        async with httpx.AsyncClient(timeout=30.0) as client: # timeout=30.0 を追加
-            geocoding_tasks = []
-            for name in destination_names:
-                search_query = f"{name}, 日本"
-                url = f"https://nominatim.openstreetmap.org/search?q={search_query}&format=json&limit=1"
-                geocoding_tasks.append(client.get(url, headers=headers))
-            
-            geocoding_responses = await asyncio.gather(*geocoding_tasks)
-
-            for i, response in enumerate(geocoding_responses):
-                response.raise_for_status()
-                geo_data = response.json()
-                if not geo_data:
-                    return JSONResponse(status_code=404, content={"message": f"目的地が見つかりませんでした: {destination_names[i]}"})
-                
-                lat = float(geo_data[0]["lat"])
-                lon = float(geo_data[0]["lon"])
-                locations.append({"name": destination_names[i], "lat": lat, "lon": lon})
-                dest_details.append({"name": destination_names[i], "duration_minutes": durations_list[i]})
-
-            first_dest = locations[1]
-            weather_url = f"https://api.open-meteo.com/v1/forecast?latitude={first_dest['lat']}&longitude={first_dest['lon']}&daily=weathercode,temperature_2m_max,precipitation_probability_max&timezone=Asia%2FTokyo&start_date={date}&end_date={date}"
-            
-            coords_str = ";".join([f"{loc['lon']},{loc['lat']}" for loc in locations])
-            osrm_driving_url = f"http://router.project-osrm.org/table/v1/driving/{coords_str}"
-            osrm_walking_url = f"http://router.project-osrm.org/table/v1/walking/{coords_str}"
-
-            weather_task = client.get(weather_url)
-            osrm_driving_task = client.get(osrm_driving_url)
-            osrm_walking_task = client.get(osrm_walking_url)
-
-            weather_response, osrm_driving_response, osrm_walking_response = await asyncio.gather(weather_task, osrm_driving_task, osrm_walking_task)
-            weather_response.raise_for_status()
-            osrm_driving_response.raise_for_status()
-            osrm_walking_response.raise_for_status()
-
-            weather_data = weather_response.json().get('daily', {})
-            weather_info = f"天気予報: 最高気温 {weather_data.get('temperature_2m_max', ['N/A'])[0]}℃, 降水確率 {weather_data.get('precipitation_probability_max', ['N/A'])[0]}%"
-            durations_driving_matrix = osrm_driving_response.json()['durations']
-            durations_walking_matrix = osrm_walking_response.json()['durations']
-
-        prompt = f"""
-        あなたは旅行プランナーAIです。以下の情報をもとに、訪問順に最適な旅行プランを立ててください。
-
-【旅行情報】
-- 旅行開始日時: 2025年9月10日 09:00
-- 出発地: 東京駅
-- 行きたい場所: 上野動物園、浅草寺、スカイツリー
-
-【制約事項】
-- 出発地点（東京駅）から始めて開始時間を基準とし、すべての目的地を順番に巡ってください。
-- 各訪問地には「滞在時間」を適切に設定してください（例: 30〜90分)。
-- 交通手段は「徒歩」または「車」のみを使用してください。
-- 各訪問ステップは、必ず以下の5つの項目をこの順番で含めてください：
-
-  1. "time"（到着または出発時刻。形式: ISO 8601、例 "2025-09-10T09:00"）
-  2. "place"（訪問地名）
-  3. "duration"（滞在時間、例: "60分"）
-  4. "transportation"（「徒歩」または「車」のいずれか）
-  5. "travel_time"（前の地点からの移動時間、例: "15分"）
-
-- 最初のステップ（出発地点）は滞在時間0分、移動時間0分、交通手段は「徒歩」で構いません。
-
---ここからはjsonフォーマットの例です。--
-[
-  {
-    "time": "2025-09-10T09:00",
-    "place": "東京駅",
-    "duration": "0分",
-    "transportation": "徒歩",
-    "travel_time": "0分"
-  },
-  {
-    "time": "2025-09-10T09:20",
-    "place": "上野動物園",
-    "duration": "60分",
-    "transportation": "車",
-    "travel_time": "20分"
-  }
-
-【注意】
-
-出力は有効なJSON形式のみで返してください。説明文やコメントは不要です。
-
-JSONの構文に誤りがないようにしてください（クォーテーションやカンマの位置など。
-
-各訪問地の「順番」「移動手段」「移動時間」「滞在時間」が論理的になるように調整してください。
-        """
-        
-        ai_response = await model.generate_content_async(prompt)
-        return JSONResponse(content={"plan": ai_response.text})
+        result = await plan_itinerary(destinations, date, durations, start_lat, start_lon, start_time)
+        if isinstance(result, JSONResponse) or not narrate:
+            return result
+
+        with stage("llm"):
+            ai_response = await model.generate_content_async(build_narration_prompt(result["plan"], result["weather"]))
+        return JSONResponse(content={**result, "narration": ai_response.text})
 
     except Exception as e:
         # エラーメッセージをより詳細に出力
-        print(f"ERROR: Exception type: {type(e).__name__}, Args: {e.args}") # 追加
+        logging.exception(f"create_itinerary failed: {type(e).__name__}")
         return JSONResponse(status_code=500, content={"message": f"An error occurred: {type(e).__name__} - {e}"}) # 修正
 
-# --- AIパーキングアシスタント機能 (バグ修正版) ---
-@app.get("/nearby-parking/")
-async def get_nearby_parking(lat: float = Query(...), lon: float = Query(...)):
+# SSE 版: event: weather → event: step (1ステップずつ JSON) → event: narration ... → event: done
+@app.get("/create-itinerary/stream")
+async def create_itinerary_stream(
+    destinations: str = Query(...),
+    date: str = Query(...),
+    durations: str = Query(...),
+    start_lat: float = Query(...),
+    start_lon: float = Query(...),
+    start_time: str = Query("09:00"),
+    narrate: bool = Query(True),
+):
     try:
-        overpass_query = f"[out:json];(node(around:1000,{lat},{lon})[amenity=parking];way(around:1000,{lat},{lon})[amenity=parking];relation(around:1000,{lat},{lon})[amenity=parking];);out center;"
-        overpass_url = "https://overpass-api.de/api/interpreter"
-        params = {"data": overpass_query}
-
-        async with httpx.AsyncClient() as client:
-            response = await client.get(overpass_url, params=params, timeout=30.0)
-            response.raise_for_status()
-            parking_data = response.json()
-
-        parking_lots = []
-        for element in parking_data.get('elements', []):
-            tags = element.get('tags', {})
-            center = element.get('center', {})
-            parking_lots.append({
-                "name": tags.get('name', '名称不明'),
-                "lat": element.get('lat') or center.get('lat'),
-                "lon": element.get('lon') or center.get('lon')
-            })
+        result = await plan_itinerary(destinations, date, durations, start_lat, start_lon, start_time)
+        if isinstance(result, JSONResponse):
+            return result
 
-        if not parking_lots:
-            return JSONResponse(content={"message": "周辺に駐車場が見つかりませんでした。", "parking_lots": []})
+        events = [sse_event(result["weather"], "weather")]
+        events.extend(sse_event(step, "step") for step in result["plan"])
+        if not narrate:
+            return sse_response(*events, sse_event("", "done"))
+        prompt = build_narration_prompt(result["plan"], result["weather"])
+        return sse_response(*events, stream_gemini(model, prompt, "narration"))
 
-        # AIに分析を依頼
-        prompt = f"""
+    except Exception as e:
+        logging.exception(f"create_itinerary_stream failed: {type(e).__name__}")
+        return JSONResponse(status_code=500, content={"message": f"An error occurred: {type(e).__name__} - {e}"})
+
+# --- AIパーキングアシスタント機能 (バグ修正版) ---
+def build_parking_prompt(lat: float, lon: float, parking_lots) -> str:
+    return f"""
         # 役割
         あなたは、日本の駐車事情に詳しい、親切なアシスタントです。
 
@@ -261,27 +358,52 @@ async def get_nearby_parking(lat: float = Query(...), lon: float = Query(...)):
         - 何か注意すべき点（最大料金の有無、道の狭さなど）はあるか。
         具体的で、現実に役立つ、親切なアドバイスを日本語でお願いします。
         """
-        
-        ai_response = await model.generate_content_async(prompt)
+
+@app.get("/nearby-parking/")
+async def get_nearby_parking(lat: float = Query(...), lon: float = Query(...)):
+    try:
+        # 取得済みのタイルはメモリから検索します (parking_index.py)
+        with stage("parking"):
+            parking_lots = await parking_index.nearby(lat, lon, radius_m=1000)
+
+        if not parking_lots:
+            return JSONResponse(content={"message": "周辺に駐車場が見つかりませんでした。", "parking_lots": []})
+
+        # AIに分析を依頼
+        with stage("llm"):
+            ai_response = await model.generate_content_async(build_parking_prompt(lat, lon, parking_lots))
         return JSONResponse(content={"plan": ai_response.text})
 
     except Exception as e:
         return JSONResponse(status_code=500, content={"message": f"An error occurred: {str(e)}"})
 
+# SSE 版: event: parking_lots (一覧) → event: chunk ... → event: done
+@app.get("/nearby-parking/stream")
+async def get_nearby_parking_stream(lat: float = Query(...), lon: float = Query(...)):
+    try:
+        with stage("parking"):
+            parking_lots = await parking_index.nearby(lat, lon, radius_m=1000)
+
+        if not parking_lots:
+            return JSONResponse(content={"message": "周辺に駐車場が見つかりませんでした。", "parking_lots": []})
+
+        prompt = build_parking_prompt(lat, lon, parking_lots)
+        return sse_response(sse_event(parking_lots, "parking_lots"), stream_gemini(model, prompt))
+
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"message": f"An error occurred: {str(e)}"})
+
 
 # --- 画像アップロード機能 ---
 @app.post("/upload-image/")
 async def upload_image(file: UploadFile = File(...)):
     try:
-        contents = await file.read()
-        blob_result = put(
-            file.filename,
-            contents,
-            options={'add_random_suffix': True, 'access': 'public'}
-        )
+        # チャンク単位で読み、同じ画像は再アップロードしません (uploads.py)
+        with stage("upload"):
+            blob_result = await uploader.upload(file)
         return JSONResponse(
             status_code=200,
-            content={"message": "Image uploaded successfully!", "url": blob_result['url']}
+            content={"message": "Image uploaded successfully!", "url": blob_result['url'], "deduplicated": blob_result['deduplicated']}
         )
     except Exception as e:
         return JSONResponse(
@@ -0,0 +1,43 @@
+# --- 重いクライアントの遅延初期化 ---
+# Vercel のコールドスタートでは import と初期化の時間がそのまま最初のレスポンスの遅れになります。
+# google.generativeai (grpc / protobuf) や tavily、vercel_blob、numpy を使う処理は
+# LazyObject で包み、最初に属性へアクセスされたときに import・初期化します。
+import threading
+
+
+class LazyObject:
+    """factory() の戻り値への代理オブジェクト。初回の属性アクセスで factory() を1度だけ呼ぶ。"""
+
+    __slots__ = ("_factory", "_instance", "_lock")
+
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_instance", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _resolve(self):
+        instance = object.__getattribute__(self, "_instance")
+        if instance is None:
+            with object.__getattribute__(self, "_lock"):
+                instance = object.__getattribute__(self, "_instance")
+                if instance is None:
+                    instance = object.__getattribute__(self, "_factory")()
+                    object.__setattr__(self, "_instance", instance)
+        return instance
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._resolve(), name, value)
+
+    def __repr__(self) -> str:
+        instance = object.__getattribute__(self, "_instance")
+        return f"<LazyObject {'unloaded' if instance is None else repr(instance)}>"
+
+
+def loaded(obj):
+    """LazyObject が初期化済みならその中身を、未初期化なら None を返す (通常のオブジェクトはそのまま返す)。"""
+    if isinstance(obj, LazyObject):
+        return object.__getattribute__(obj, "_instance")
+    return obj
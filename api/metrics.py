@@ -0,0 +1,357 @@
+# --- 計測 (レイテンシ・エラー・キャッシュヒット) ---
+# どこが遅いのかを切り分けるために、次を記録します。
+#   - 外部API (Nominatim / Open-Meteo / OSRM / Overpass) への1リクエストごとの所要時間
+#   - 処理の段階 (geocode / weather / matrix / llm など) ごとの所要時間
+#   - エラーの件数と、各キャッシュのヒット/ミスの件数
+# 集計は /metrics で Prometheus のテキスト形式で返し、リクエストごとの内訳は Server-Timing ヘッダーに載せます。
+# 値はプロセスごと (Vercel ではインスタンスごと) の集計です。
+#
+# プロファイリング: 環境変数 PROFILE_TOKEN を設定し、リクエストに "X-Profile: <PROFILE_TOKEN>" を付けると、
+# そのリクエストの間だけイベントループのスタックをサンプリングします。結果はレスポンスの X-Profile-Id で
+# /debug/profile/{id} から collapsed stack 形式 (flamegraph.pl / speedscope で読める) で取得できます。
+import contextvars
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter as StackCounter
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import httpx
+from starlette.datastructures import MutableHeaders
+
+METRICS_PREFIX = "final_app_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")
+PROFILE_HEADER = b"x-profile"
+PROFILE_INTERVAL_SECONDS = float(os.environ.get("PROFILE_INTERVAL_SECONDS", 0.005))
+# 取得用に残しておく直近のプロファイル数
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 32))
+
+REGISTRY = []
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class _Metric:
+    type = ""
+    # HELP / TYPE 行で使う名前の接尾辞 (Counter はサンプルと同じ _total 付きの名前にします)
+    suffix = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = METRICS_PREFIX + name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        family = self.name + self.suffix
+        lines = [f"# HELP {family} {self.documentation}", f"# TYPE {family} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(dict(zip(self.labelnames, key)), value))
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+    suffix = "_total"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self, labels: dict, value) -> list[str]:
+        return [f"{self.name}{self.suffix}{_format_labels(labels)} {value}"]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # [バケットごとの件数 (+Inf を含む), 合計, 件数]
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            counts[0][index] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def _samples(self, labels: dict, value) -> list[str]:
+        bucket_counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip((*self.buckets, "+Inf"), bucket_counts):
+            cumulative += bucket_count
+            lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': bound})} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "Time from request start to the last response byte.", ("method", "route", "status"))
+STAGE_LATENCY = Histogram("stage_duration_seconds", "Time spent in each pipeline stage.", ("stage",))
+UPSTREAM_LATENCY = Histogram("upstream_request_duration_seconds", "Time of each upstream HTTP request including the body.", ("upstream", "status"))
+ERRORS = Counter("errors", "Errors by where they happened and exception type.", ("where", "type"))
+CACHE_REQUESTS = Counter("cache_requests", "Cache lookups by cache and result.", ("cache", "result"))
+
+
+def render() -> str:
+    """全メトリクスを Prometheus のテキスト形式 (0.0.4) で返す。"""
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# --- リクエストごとの内訳 (Server-Timing) ---
+# asyncio.create_task は作成時のコンテキストを引き継ぐので、裏のタスクで行った計測も
+# そのタスクを作ったリクエストのリストに入ります。
+_timings: contextvars.ContextVar[list | None] = contextvars.ContextVar("server_timings", default=None)
+
+
+def observe(name: str, seconds: float) -> None:
+    STAGE_LATENCY.observe(seconds, stage=name)
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+def count_error(where: str, error: BaseException) -> None:
+    ERRORS.inc(where=where, type=type(error).__name__)
+
+
+def cache_result(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+@contextmanager
+def stage(name: str):
+    """with stage("geocode"): ... の所要時間を記録する (await を挟んでも使える)。"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        count_error(name, e)
+        raise
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+async def timed(name: str, awaitable):
+    """asyncio.gather に渡すコルーチンを段階として計測する。"""
+    with stage(name):
+        return await awaitable
+
+
+def server_timing(timings: list, total: float) -> str:
+    # 同じ名前 (並列の OSRM 呼び出しなど) は合計し、回数を desc に入れます
+    merged: dict[str, list] = {}
+    for name, seconds in timings:
+        entry = merged.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+    parts = []
+    for name, (seconds, count) in merged.items():
+        part = f"{name};dur={seconds * 1000:.1f}"
+        if count > 1:
+            part += f';desc="{count} calls"'
+        parts.append(part)
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# --- 外部APIの計測 ---
+class _TimedStream(httpx.AsyncByteStream):
+    """レスポンス本文を読み終えて閉じたときに on_close を呼ぶ。"""
+
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close is not None:
+                on_close()
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """接続先ごとのトランスポートを包み、本文の受信完了までを1回の呼び出しとして記録する。"""
+
+    def __init__(self, upstream: str, transport: httpx.AsyncBaseTransport):
+        self.upstream = upstream
+        self._transport = transport
+
+    def _finish(self, started: float, status: str) -> None:
+        seconds = time.perf_counter() - started
+        UPSTREAM_LATENCY.observe(seconds, upstream=self.upstream, status=status)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((self.upstream, seconds))
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except Exception as e:
+            self._finish(started, "error")
+            count_error(f"upstream:{self.upstream}", e)
+            raise
+
+        status = str(response.status_code)
+        if response.status_code >= 500:
+            ERRORS.inc(where=f"upstream:{self.upstream}", type=f"HTTP {status}")
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_TimedStream(response.stream, lambda: self._finish(started, status)),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+# --- プロファイリング ---
+class StackSampler:
+    """別スレッドから thread_id のスタックを一定間隔で記録する。"""
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL_SECONDS):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = StackCounter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self) -> str:
+        """サンプリングを止め、collapsed stack 形式 ("f1;f2;f3 回数" の行) で返す。"""
+        self._stop.set()
+        self._thread.join()
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+profiles: OrderedDict[str, str] = OrderedDict()
+# イベントループのスレッドは1つなので、同時に取るプロファイルも1つだけにします
+# (サンプルには同じ時間に処理していた他のリクエストも含まれます)
+_profiling = threading.Lock()
+
+
+def profile_requested(scope) -> bool:
+    if not PROFILE_TOKEN:
+        return False
+    return any(name == PROFILE_HEADER and value.decode("latin-1") == PROFILE_TOKEN for name, value in scope["headers"])
+
+
+def save_profile(profile_id: str, profile: str) -> None:
+    profiles[profile_id] = profile
+    while len(profiles) > PROFILE_KEEP:
+        profiles.popitem(last=False)
+
+
+def get_profile(profile_id: str) -> str | None:
+    return profiles.get(profile_id)
+
+
+class MetricsMiddleware:
+    """リクエスト全体の所要時間を記録し、Server-Timing ヘッダーを付ける ASGI ミドルウェア。"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = []
+        token = _timings.set(timings)
+        started = time.perf_counter()
+        status = 500
+        profile_id = None
+        sampler = None
+        if profile_requested(scope) and _profiling.acquire(blocking=False):
+            profile_id = uuid.uuid4().hex
+            sampler = StackSampler(threading.get_ident()).start()
+
+        def finish_profile() -> None:
+            nonlocal sampler
+            if sampler is not None:
+                save_profile(profile_id, sampler.stop())
+                sampler = None
+                _profiling.release()
+
+        async def send_with_timing(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                # SSE ではヘッダーを先に送るので、その後の段階 (llm など) は /metrics にだけ載ります
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", server_timing(timings, time.perf_counter() - started))
+                headers.append("Timing-Allow-Origin", "*")
+                if profile_id is not None:
+                    headers.append("X-Profile-Id", profile_id)
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                # 最後の本文を送る前に止めるので、レスポンスを受け取った直後から取得できます
+                finish_profile()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        except Exception as e:
+            count_error("http", e)
+            raise
+        finally:
+            finish_profile()
+            route = scope.get("route")
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                # 未定義のパスはまとめて数え、ラベルの種類が増えすぎないようにします
+                route=getattr(route, "path", "unmatched"),
+                status=str(status),
+            )
+            _timings.reset(token)
@@ -0,0 +1,285 @@
+# --- 駐車場の空間インデックス ---
+# Overpass から取得した駐車場 (node / way / relation) を slippy map タイル (ズーム14, 約2km四方) ごとに
+# メモリに保持します。半径検索は対象タイルの配列をまとめて haversine 距離で絞り込み、近い順に返します。
+# 手元に無いタイルだけを bbox 指定で Overpass に問い合わせるので、同じ地域の2回目以降は通信しません。
+#
+# 都道府県単位の一括読み込み (スナップショット作成):
+#   python api/parking_index.py --bbox 35.50,138.94,35.90,139.92 --out parking-tokyo.json
+#   python api/parking_index.py --bbox 35.50,138.94,35.90,139.92 --extract overpass-export.json --out parking-tokyo.json
+# 作成したファイルを PARKING_SNAPSHOT_PATH に指定すると、初回検索時に読み込みます。
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+
+import numpy as np
+
+from cache import LRUCache, SingleFlight
+from metrics import cache_result
+
+PARKING_TILE_ZOOM = int(os.environ.get("PARKING_TILE_ZOOM", 14))
+PARKING_TILE_TTL_SECONDS = float(os.environ.get("PARKING_TILE_TTL_SECONDS", 24 * 3600))
+PARKING_SNAPSHOT_TTL_SECONDS = float(os.environ.get("PARKING_SNAPSHOT_TTL_SECONDS", 30 * 24 * 3600))
+PARKING_TILE_CACHE_SIZE = int(os.environ.get("PARKING_TILE_CACHE_SIZE", 4096))
+PARKING_SNAPSHOT_PATH = os.environ.get("PARKING_SNAPSHOT_PATH")
+# 取得中のタイルと同じ SingleFlight で、スナップショットの読み込みを1回にまとめるためのキー
+SNAPSHOT_KEY = "snapshot"
+
+EARTH_RADIUS_M = 6371008.8
+UNKNOWN_NAME = '名称不明'
+
+
+def tile_for(lat: float, lon: float, zoom: int = PARKING_TILE_ZOOM) -> tuple[int, int]:
+    n = 1 << zoom
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(x: int, y: int, zoom: int = PARKING_TILE_ZOOM) -> tuple[float, float, float, float]:
+    """(south, west, north, east) を返す。"""
+    n = 1 << zoom
+
+    def lat_of(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return lat_of(y + 1), x / n * 360.0 - 180.0, lat_of(y), (x + 1) / n * 360.0 - 180.0
+
+
+def tiles_covering(lat: float, lon: float, radius_m: float, zoom: int = PARKING_TILE_ZOOM) -> list[tuple[int, int]]:
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+    x0, y0 = tile_for(lat + dlat, lon - dlon, zoom)
+    x1, y1 = tile_for(lat - dlat, lon + dlon, zoom)
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def haversine_m(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def parse_elements(elements) -> list[tuple[str, str, float, float]]:
+    """Overpass の elements を (id, 名前, 緯度, 経度) のリストにする。"""
+    lots = []
+    for element in elements:
+        tags = element.get('tags', {})
+        center = element.get('center', {})
+        lat = element.get('lat') or center.get('lat')
+        lon = element.get('lon') or center.get('lon')
+        if lat is None or lon is None:
+            continue
+        lots.append((f"{element.get('type', 'node')}/{element.get('id')}", tags.get('name', UNKNOWN_NAME), float(lat), float(lon)))
+    return lots
+
+
+class Tile:
+    __slots__ = ("ids", "names", "lats", "lons")
+
+    def __init__(self, lots):
+        self.ids = [lot[0] for lot in lots]
+        self.names = [lot[1] for lot in lots]
+        self.lats = np.array([lot[2] for lot in lots], dtype=float)
+        self.lons = np.array([lot[3] for lot in lots], dtype=float)
+
+
+def bucket_by_tile(lots, zoom: int = PARKING_TILE_ZOOM) -> dict:
+    buckets = {}
+    for lot in lots:
+        buckets.setdefault(tile_for(lot[2], lot[3], zoom), []).append(lot)
+    return buckets
+
+
+class ParkingIndex:
+    def __init__(
+        self,
+        client_factory,
+        zoom: int = PARKING_TILE_ZOOM,
+        ttl: float = PARKING_TILE_TTL_SECONDS,
+        maxsize: int = PARKING_TILE_CACHE_SIZE,
+        snapshot_path: str | None = PARKING_SNAPSHOT_PATH,
+    ):
+        self._client_factory = client_factory
+        self.zoom = zoom
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self._tiles = LRUCache(maxsize)
+        # スナップショットのタイルは LRU の外に置きます。大きい都道府県では LRU の上限より多く、
+        # LRU に入れると読み込んだ直後にほとんどが押し出されて Overpass に問い合わせ直すことになるためです
+        # (期限, {タイル: Tile})
+        self._snapshot: tuple[float, dict] = (0.0, {})
+        self._inflight = SingleFlight()
+        self._snapshot_loaded = False
+
+    def load_snapshot(self, path: str) -> int:
+        """bulk loader で作ったスナップショットを読み込み、読み込んだタイル数を返す。"""
+        with open(path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+        expires_at = snapshot.get("created", time.time()) + PARKING_SNAPSHOT_TTL_SECONDS
+        if expires_at <= time.time():
+            logging.warning(f"Parking snapshot {path} is older than its TTL; ignoring it.")
+            return 0
+        # タイル番号はズームごとに別物なので、違うズームで作ったスナップショットは使えません
+        if snapshot.get("zoom") != self.zoom:
+            logging.warning(f"Parking snapshot {path} was built at zoom {snapshot.get('zoom')}, not {self.zoom}; ignoring it.")
+            return 0
+        lots = [tuple(lot) for lot in snapshot["lots"]]
+        buckets = bucket_by_tile(lots, self.zoom)
+        # 駐車場が1つも無いタイルも「取得済み」として扱います
+        tiles = {tuple(key): Tile(buckets.get(tuple(key), [])) for key in snapshot["tiles"]}
+        self._snapshot = (expires_at, tiles)
+        return len(tiles)
+
+    async def _ensure_snapshot(self) -> None:
+        if self._snapshot_loaded or not self.snapshot_path:
+            return
+        # 同時に来たリクエストは同じ読み込みを待ちます
+        await asyncio.shield(self._inflight.run(SNAPSHOT_KEY, self._load_snapshot))
+
+    async def _load_snapshot(self) -> None:
+        # JSON の解析と NumPy 配列の作成はイベントループを止めないよう別スレッドで行います
+        try:
+            count = await asyncio.to_thread(self.load_snapshot, self.snapshot_path)
+            logging.info(f"Loaded {count} parking tiles from {self.snapshot_path}")
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Failed to load parking snapshot {self.snapshot_path}: {e}")
+        self._snapshot_loaded = True
+
+    def _tile(self, key) -> Tile | None:
+        # Overpass から取り直したタイルがあればそちらを優先します
+        hit, tile = self._tiles.get(key)
+        if hit:
+            return tile
+        expires_at, tiles = self._snapshot
+        if time.time() < expires_at:
+            return tiles.get(key)
+        return None
+
+    async def _fetch_tiles(self, keys: list[tuple[int, int]]) -> None:
+        # 足りないタイルをまとめた bbox で1回だけ問い合わせます
+        bounds = [tile_bounds(x, y, self.zoom) for x, y in keys]
+        south = min(b[0] for b in bounds)
+        west = min(b[1] for b in bounds)
+        north = max(b[2] for b in bounds)
+        east = max(b[3] for b in bounds)
+        overpass_query = f"[out:json][timeout:25];nwr[amenity=parking]({south},{west},{north},{east});out center;"
+        response = await self._client_factory().get("/api/interpreter", params={"data": overpass_query})
+        response.raise_for_status()
+
+        buckets = bucket_by_tile(parse_elements(response.json().get('elements', [])), self.zoom)
+        expires_at = time.time() + self.ttl
+        for key in keys:
+            # bbox に掛かっただけで中心が別タイルにある way などは捨てます
+            self._tiles.set(key, Tile(buckets.get(key, [])), expires_at)
+
+    async def _ensure_tiles(self, keys: list[tuple[int, int]]) -> list[Tile]:
+        await self._ensure_snapshot()
+        waits = set()
+        missing = []
+        for key in keys:
+            hit = self._tile(key) is not None
+            cache_result("parking_tile", hit)
+            if hit:
+                continue
+            task = self._inflight.get(key)
+            if task is None:
+                missing.append(key)
+            else:
+                waits.add(task)
+
+        if missing:
+            # 足りないタイルは1つのタスクでまとめて取得し、各タイルのキーに登録します
+            waits.add(self._inflight.start(missing, lambda: self._fetch_tiles(missing)))
+        if waits:
+            await asyncio.gather(*(asyncio.shield(t) for t in waits))
+
+        # 取得直後に LRU から押し出されたタイルは結果に含めません
+        return [tile for tile in (self._tile(key) for key in keys) if tile is not None]
+
+    async def nearby(self, lat: float, lon: float, radius_m: float = 1000, limit: int | None = None) -> list[dict]:
+        """半径 radius_m 以内の駐車場を近い順に返す。"""
+        tiles = await self._ensure_tiles(tiles_covering(lat, lon, radius_m, self.zoom))
+        tiles = [tile for tile in tiles if len(tile.ids)]
+        if not tiles:
+            return []
+
+        lats = np.concatenate([tile.lats for tile in tiles])
+        lons = np.concatenate([tile.lons for tile in tiles])
+        distances = haversine_m(lat, lon, lats, lons)
+        inside = np.nonzero(distances <= radius_m)[0]
+        order = inside[np.argsort(distances[inside], kind="stable")]
+        if limit is not None:
+            order = order[:limit]
+
+        names = [name for tile in tiles for name in tile.names]
+        return [
+            {"name": names[i], "lat": float(lats[i]), "lon": float(lons[i]), "distance_m": round(float(distances[i]))}
+            for i in order
+        ]
+
+
+def tiles_within(south: float, west: float, north: float, east: float, zoom: int = PARKING_TILE_ZOOM) -> list[tuple[int, int]]:
+    """bbox に完全に含まれるタイルの一覧。"""
+    x0, y0 = tile_for(north, west, zoom)
+    x1, y1 = tile_for(south, east, zoom)
+    tiles = []
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            s, w, n, e = tile_bounds(x, y, zoom)
+            if s >= south and w >= west and n <= north and e <= east:
+                tiles.append((x, y))
+    return tiles
+
+
+async def _fetch_bbox(south: float, west: float, north: float, east: float) -> list:
+    from upstream import pool, get_client
+
+    overpass_query = f"[out:json][timeout:600];nwr[amenity=parking]({south},{west},{north},{east});out center;"
+    try:
+        response = await get_client("overpass").get("/api/interpreter", params={"data": overpass_query}, timeout=660.0)
+        response.raise_for_status()
+        return response.json().get('elements', [])
+    finally:
+        await pool.aclose()
+
+
+def build_snapshot(elements, bbox, zoom: int = PARKING_TILE_ZOOM) -> dict:
+    """bbox に完全に含まれるタイルだけを「取得済み」として記録する。
+
+    境界に掛かるタイルは抽出範囲外の駐車場が欠けているので含めず、実行時に Overpass から取得します。
+    """
+    tiles = set(tiles_within(*bbox, zoom=zoom))
+    unique = {lot[0]: lot for lot in parse_elements(elements)}
+    lots = [list(lot) for lot in unique.values() if tile_for(lot[2], lot[3], zoom) in tiles]
+    return {
+        "created": time.time(),
+        "zoom": zoom,
+        "tiles": sorted(tiles),
+        "lots": lots,
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="都道府県単位の駐車場スナップショットを作成します")
+    parser.add_argument("--bbox", required=True, help="対象範囲 south,west,north,east (例: 東京都本土 35.50,138.94,35.90,139.92)")
+    parser.add_argument("--extract", help="bbox 全体を含む Overpass の JSON 出力 (out center)。省略時は Overpass から取得")
+    parser.add_argument("--out", required=True, help="出力するスナップショットのパス")
+    args = parser.parse_args()
+
+    bbox = tuple(float(v) for v in args.bbox.split(","))
+    if args.extract:
+        with open(args.extract, encoding="utf-8") as f:
+            elements = json.load(f).get('elements', [])
+    else:
+        elements = asyncio.run(_fetch_bbox(*bbox))
+
+    snapshot = build_snapshot(elements, bbox)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    logging.info(f"Wrote {len(snapshot['lots'])} parking lots in {len(snapshot['tiles'])} tiles to {args.out}")
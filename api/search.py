@@ -0,0 +1,112 @@
+# --- AI検索の検索結果キャッシュとプロンプト用コンテキスト ---
+# Tavily の検索は非同期クライアントで行い、正規化したクエリ単位で結果を TTL 付きでキャッシュします。
+# プロンプトには検索結果の生の dict ではなく、重複を除いてトークン数の上限内に収めた抜粋だけを渡します。
+import asyncio
+import logging
+import os
+import re
+import time
+
+from cache import LRUCache, SingleFlight, normalize_place_name
+from metrics import cache_result
+
+SEARCH_CACHE_TTL_SECONDS = float(os.environ.get("SEARCH_CACHE_TTL_SECONDS", 3600))
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", 1024))
+SEARCH_CONTEXT_TOKENS = int(os.environ.get("SEARCH_CONTEXT_TOKENS", 2000))
+# Gemini のトークナイザーは公開されていないので、近い目安として cl100k_base で数えます
+SEARCH_TOKEN_ENCODING = os.environ.get("SEARCH_TOKEN_ENCODING", "cl100k_base")
+
+_SENTENCE_END = re.compile(r"(?<=[。！？!?])|(?<=\.)\s+|\n+")
+
+# 検索クエリの正規化は地名と同じ規則 (NFKC・空白・大文字小文字) で行います
+normalize_query = normalize_place_name
+
+_encoding = None
+
+
+class CharEncoding:
+    """tiktoken の定義ファイルを取得できない環境用の目安。1文字を1トークンとして数える (日本語では多めに見積もる)。"""
+
+    def encode(self, text: str) -> list[str]:
+        return list(text)
+
+    def decode(self, tokens) -> str:
+        return "".join(tokens)
+
+
+def get_encoding():
+    # tiktoken は初回にエンコーディング定義を読み込む (ネットワークから取得する) ので、使うときまで遅らせます
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(SEARCH_TOKEN_ENCODING)
+        except Exception as e:
+            logging.warning(f"tiktoken encoding {SEARCH_TOKEN_ENCODING} unavailable, counting characters instead: {e}")
+            _encoding = CharEncoding()
+    return _encoding
+
+
+def build_context(results, budget: int = SEARCH_CONTEXT_TOKENS, encoding=None) -> str:
+    """検索結果から重複する URL・文を除き、budget トークン以内の抜粋にまとめる。"""
+    encoding = encoding or get_encoding()
+    seen_urls = set()
+    seen_sentences = set()
+    blocks = []
+    remaining = budget
+
+    for result in results:
+        url = result.get("url", "")
+        if url in seen_urls:
+            continue
+        seen_urls.add(url)
+
+        sentences = []
+        for sentence in _SENTENCE_END.split(result.get("content") or ""):
+            sentence = sentence.strip()
+            key = normalize_query(sentence)
+            if not sentence or key in seen_sentences:
+                continue
+            seen_sentences.add(key)
+            sentences.append(sentence)
+        if not sentences:
+            continue
+
+        block = f"[{len(blocks) + 1}] {result.get('title', '')} ({url})\n" + " ".join(sentences)
+        tokens = encoding.encode(block)
+        if len(tokens) > remaining:
+            if remaining < 32:
+                break
+            block = encoding.decode(tokens[:remaining]) + "…"
+            tokens = tokens[:remaining]
+        blocks.append(block)
+        remaining -= len(tokens)
+        if remaining <= 0:
+            break
+
+    return "\n\n".join(blocks)
+
+
+class SearchCache:
+    """正規化したクエリごとに Tavily の検索結果を保持する。同時の同一クエリは1回の検索にまとめる。"""
+
+    def __init__(self, client_factory, ttl: float = SEARCH_CACHE_TTL_SECONDS, maxsize: int = SEARCH_CACHE_SIZE):
+        self._client_factory = client_factory
+        self.ttl = ttl
+        self.lru = LRUCache(maxsize)
+        self._inflight = SingleFlight()
+
+    async def search(self, query: str) -> list[dict]:
+        key = normalize_query(query)
+        hit, results = self.lru.get(key)
+        cache_result("search", hit)
+        if hit:
+            return results
+
+        return await asyncio.shield(self._inflight.run(key, lambda: self._search(key, query)))
+
+    async def _search(self, key: str, query: str) -> list[dict]:
+        response = await self._client_factory().search(query=query, search_depth="advanced")
+        results = response.get("results", [])
+        self.lru.set(key, results, time.time() + self.ttl)
+        return results
@@ -0,0 +1,71 @@
+# --- Server-Sent Events のストリーミング ---
+# Gemini の生成結果を完成まで待たずに、届いた分から SSE でクライアントへ送ります。
+# クライアントが切断すると Starlette が送信タスクをキャンセルするので、
+# 生成中の Gemini ストリームもそこで打ち切られます。
+import json
+import logging
+import time
+
+from fastapi.responses import StreamingResponse
+
+from metrics import count_error, observe
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # Vercel / nginx のバッファリングを無効にして、チャンクをすぐに流します
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(data, event: str | None = None) -> str:
+    """1つの SSE イベントを組み立てる。dict / list は JSON にして1行で送る。"""
+    if not isinstance(data, str):
+        data = json.dumps(data, ensure_ascii=False)
+    lines = [f"event: {event}"] if event else []
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+async def stream_gemini(model, prompt: str, event: str = "chunk", on_complete=None):
+    """Gemini のストリーミング生成を SSE イベントとして順に返す。
+
+    on_complete を渡すと、エラーや切断なく生成が終わったときに全文で呼び出す (キャッシュ用)。
+    """
+    started = time.perf_counter()
+    first_chunk = True
+    texts = []
+    try:
+        response = await model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            if chunk.text:
+                if first_chunk:
+                    observe("llm_first_chunk", time.perf_counter() - started)
+                    first_chunk = False
+                texts.append(chunk.text)
+                yield sse_event(chunk.text, event)
+    except Exception as e:
+        count_error("llm", e)
+        # ヘッダーは送信済みなのでステータスコードは変えられません。エラーはイベントで伝えます
+        yield sse_event({"message": f"An error occurred: {str(e)}"}, "error")
+        return
+    finally:
+        # クライアント切断時は CancelledError がここを通ります
+        observe("llm", time.perf_counter() - started)
+        logging.debug("Gemini stream closed.")
+    if on_complete is not None:
+        on_complete("".join(texts))
+    yield sse_event("", "done")
+
+
+async def chain(*parts):
+    """SSE 文字列と非同期ジェネレーターを順に流す。"""
+    for part in parts:
+        if isinstance(part, str):
+            yield part
+        else:
+            async for item in part:
+                yield item
+
+
+def sse_response(*parts) -> StreamingResponse:
+    return StreamingResponse(chain(*parts), media_type="text/event-stream", headers=SSE_HEADERS)
@@ -0,0 +1,166 @@
+# --- 画像アップロードのパイプライン ---
+# vercel_blob の put / multipart は requests を使う同期処理なので、イベントループではなく
+# 専用のスレッドプール (同時実行数に上限あり) で実行します。
+#   1. 受け取ったファイルをチャンクごとに読みながら SHA-256 を計算 (全体をメモリに載せない)
+#   2. 同じ内容の画像がアップロード済みなら、その URL を返してアップロードを省略
+#   3. 大きいファイルは multipart で、パートを並列にアップロード
+# メモリに読み込むデータは、全リクエスト合わせて UPLOAD_PART_CONCURRENCY 個分までに抑えます。
+import asyncio
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from vercel_blob import blob_store
+from vercel_blob.utils import guess_mime_type
+
+from cache import LRUCache, SingleFlight
+from metrics import cache_result
+
+# Blob の multipart は最後以外のパートが 5MB 以上である必要があります
+UPLOAD_PART_SIZE = int(os.environ.get("UPLOAD_PART_SIZE", 5 * 1024 * 1024))
+UPLOAD_MULTIPART_THRESHOLD = int(os.environ.get("UPLOAD_MULTIPART_THRESHOLD", 8 * 1024 * 1024))
+UPLOAD_PART_CONCURRENCY = int(os.environ.get("UPLOAD_PART_CONCURRENCY", 4))
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 8))
+UPLOAD_READ_SIZE = 1024 * 1024
+UPLOAD_PREFIX = "images/"
+# アップロード済み URL は消さない限り有効なので長めに覚えておきます
+UPLOAD_DEDUP_TTL_SECONDS = float(os.environ.get("UPLOAD_DEDUP_TTL_SECONDS", 7 * 24 * 3600))
+UPLOAD_DEDUP_SIZE = int(os.environ.get("UPLOAD_DEDUP_SIZE", 4096))
+
+
+class Uploader:
+    def __init__(self, workers: int = UPLOAD_WORKERS, part_size: int = UPLOAD_PART_SIZE,
+                 multipart_threshold: int = UPLOAD_MULTIPART_THRESHOLD, part_concurrency: int = UPLOAD_PART_CONCURRENCY):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload")
+        self.part_size = part_size
+        self.multipart_threshold = multipart_threshold
+        self.part_concurrency = part_concurrency
+        # 読み込み中・送信中のパート (小さいファイルは全体) の枠。全アップロードで共有します (_slots)
+        self._semaphore: asyncio.Semaphore | None = None
+        self._semaphore_loop: asyncio.AbstractEventLoop | None = None
+        self.uploaded = LRUCache(UPLOAD_DEDUP_SIZE)
+        self._inflight = SingleFlight()
+
+    @property
+    def _slots(self) -> asyncio.Semaphore:
+        # asyncio.Semaphore は最初に待たされたイベントループに結び付くので、
+        # 呼び出しごとにループを作り直す ASGI ブリッジでは、ループが変わったら作り直します
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.part_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def upload(self, file) -> dict:
+        """UploadFile をアップロードし、{"url", "pathname", "deduplicated"} を返す。"""
+        digest, size = await self._hash(file)
+        _, ext = os.path.splitext(file.filename or "")
+        pathname = f"{UPLOAD_PREFIX}{digest}{ext.lower()}"
+
+        hit, url = self.uploaded.get(digest)
+        cache_result("upload_memory", hit)
+        if hit:
+            return {"url": url, "pathname": pathname, "deduplicated": True}
+
+        # 同じ画像が同時に送られてきた場合も、アップロードは1回だけにします
+        task = self._inflight.get(digest)
+        if task is not None:
+            result = await asyncio.shield(task)
+            return {**result, "deduplicated": True}
+        return await asyncio.shield(self._inflight.run(digest, lambda: self._upload(file, digest, pathname, size)))
+
+    async def _hash(self, file) -> tuple[str, int]:
+        sha256 = hashlib.sha256()
+        size = 0
+        await file.seek(0)
+        while chunk := await file.read(UPLOAD_READ_SIZE):
+            await self._run(sha256.update, chunk)
+            size += len(chunk)
+        await file.seek(0)
+        return sha256.hexdigest(), size
+
+    async def _upload(self, file, digest: str, pathname: str, size: int) -> dict:
+        # 別のインスタンスがアップロード済みかもしれないので、Blob ストアも確認します
+        existing = await self._run(find_blob, pathname)
+        cache_result("upload_store", existing is not None)
+        if existing is not None:
+            result = {"url": existing, "pathname": pathname, "deduplicated": True}
+        else:
+            if size < self.multipart_threshold:
+                async with self._slots:
+                    data = await file.read()
+                    blob_result = await self._run(put_small, pathname, data)
+            else:
+                blob_result = await self._upload_multipart(file, pathname)
+            result = {"url": blob_result["url"], "pathname": pathname, "deduplicated": False}
+        # 結果の記録もタスクの中で行うので、最初の呼び出し元が切断しても残ります
+        self.uploaded.set(digest, result["url"], time.time() + UPLOAD_DEDUP_TTL_SECONDS)
+        return result
+
+    async def _upload_multipart(self, file, pathname: str) -> dict:
+        headers = blob_headers(pathname)
+        options = {}
+        upload_info = await self._run(blob_store._create_multipart_upload, pathname, headers, options)
+        upload_id, key = upload_info["uploadId"], upload_info["key"]
+
+        semaphore = self._slots
+        uploads = []
+
+        try:
+            part_number = 0
+            while True:
+                # 枠が空いてから次のパートを読むので、メモリ上のパートは part_concurrency 個までです
+                await semaphore.acquire()
+                try:
+                    data = await file.read(self.part_size)
+                except BaseException:
+                    semaphore.release()
+                    raise
+                if not data:
+                    semaphore.release()
+                    break
+                part_number += 1
+                task = asyncio.create_task(
+                    self._run(blob_store._upload_part, pathname, upload_id, key, part_number, data, headers, options)
+                )
+                # 始まる前にキャンセルされたタスクでも枠が返るように、完了時のコールバックで解放します
+                task.add_done_callback(lambda _: semaphore.release())
+                uploads.append(task)
+            parts = await asyncio.gather(*uploads)
+        except BaseException:
+            for task in uploads:
+                task.cancel()
+            raise
+
+        return await self._run(blob_store._complete_multipart_upload, pathname, upload_id, key, parts, headers, options)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def blob_headers(pathname: str) -> dict:
+    # vercel_blob.put が組み立てるヘッダーと同じもの (multipart 用)
+    return {
+        "access": "public",
+        "authorization": f"Bearer {blob_store._get_auth_token({})}",
+        "x-api-version": blob_store._API_VERSION,
+        "x-content-type": guess_mime_type(pathname),
+        "x-cache-control-max-age": blob_store._DEFAULT_CACHE_AGE,
+        "x-allow-overwrite": "1",
+    }
+
+
+def put_small(pathname: str, data: bytes) -> dict:
+    return blob_store.put(pathname, data, options={'allowOverwrite': True})
+
+
+def find_blob(pathname: str) -> str | None:
+    result = blob_store.list({'prefix': pathname, 'limit': '1'})
+    for blob in result.get('blobs', []):
+        if blob.get('pathname') == pathname:
+            return blob.get('url')
+    return None
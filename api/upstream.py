@@ -0,0 +1,134 @@
+# --- 外部APIへの共有HTTPクライアント ---
+# Open-Meteo / Nominatim / OSRM (車・徒歩) / Overpass への接続をアプリ全体で使い回します。
+# リクエストごとに httpx.AsyncClient を作るとTCP+TLSハンドシェイクが毎回発生するため、
+# 接続先ごとにクライアントを1つだけ持ち、FastAPI の lifespan で作成・破棄します。
+import asyncio
+import importlib.util
+import logging
+import os
+from dataclasses import dataclass
+
+import httpx
+
+from metrics import InstrumentedTransport
+
+USER_AGENT = 'FinalApp/1.0 (ryo-pow)'
+
+# h2 が入っていない環境では HTTP/1.1 の keep-alive のみで動かします
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+@dataclass(frozen=True)
+class Upstream:
+    """接続先ごとの設定。base_url は環境変数で差し替え可能 (ベンチマーク用)。"""
+    base_url: str
+    connect_timeout: float
+    read_timeout: float
+    max_connections: int
+    http2: bool = True
+    keepalive_expiry: float = 30.0
+
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(connect=self.connect_timeout, read=self.read_timeout, write=self.read_timeout, pool=self.connect_timeout)
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+
+UPSTREAMS = {
+    "open_meteo": Upstream(
+        base_url=os.environ.get("OPEN_METEO_BASE_URL", "https://api.open-meteo.com"),
+        connect_timeout=3.0, read_timeout=10.0, max_connections=20,
+    ),
+    # Nominatim は利用規約で並列アクセスが制限されているので接続数を絞ります
+    "nominatim": Upstream(
+        base_url=os.environ.get("NOMINATIM_BASE_URL", "https://nominatim.openstreetmap.org"),
+        connect_timeout=3.0, read_timeout=10.0, max_connections=2,
+    ),
+    # 公開 OSRM サーバーは http のみなので HTTP/2 は使いません
+    "osrm": Upstream(
+        base_url=os.environ.get("OSRM_BASE_URL", "http://router.project-osrm.org"),
+        connect_timeout=3.0, read_timeout=15.0, max_connections=10, http2=False,
+    ),
+    # 公開 OSRM サーバーは車のプロファイルしか持たず /walking/ も車の値を返すので、
+    # 徒歩の行列は徒歩プロファイルのサーバー (既定は FOSSGIS の routed-foot) に問い合わせます
+    "osrm_walking": Upstream(
+        base_url=os.environ.get("OSRM_WALKING_BASE_URL", "https://routing.openstreetmap.de/routed-foot"),
+        connect_timeout=3.0, read_timeout=15.0, max_connections=4,
+    ),
+    "overpass": Upstream(
+        base_url=os.environ.get("OVERPASS_BASE_URL", "https://overpass-api.de"),
+        connect_timeout=5.0, read_timeout=30.0, max_connections=4,
+    ),
+}
+
+
+class UpstreamPool:
+    """接続先ごとに1つの httpx.AsyncClient を保持するプール。"""
+
+    def __init__(self, upstreams: dict[str, Upstream] = UPSTREAMS):
+        self._upstreams = upstreams
+        self._clients: dict[str, httpx.AsyncClient] = {}
+        # クライアントを作ったときのイベントループ。接続はそのループに結び付いています
+        self._loops: dict[str, asyncio.AbstractEventLoop] = {}
+        # 古いループのクライアントを閉じるタスク (完了まで参照を持っておきます)
+        self._closing: set[asyncio.Task] = set()
+
+    def _create(self, name: str) -> httpx.AsyncClient:
+        upstream = self._upstreams[name]
+        # 呼び出しごとの所要時間を記録するため、トランスポートを包みます (metrics.py)
+        transport = httpx.AsyncHTTPTransport(http2=upstream.http2 and HTTP2_AVAILABLE, limits=upstream.limits())
+        return httpx.AsyncClient(
+            base_url=upstream.base_url,
+            transport=InstrumentedTransport(name, transport),
+            timeout=upstream.timeout(),
+            headers={'User-Agent': USER_AGENT},
+        )
+
+    async def start(self) -> None:
+        for name in self._upstreams:
+            if name not in self._clients:
+                self.client(name)
+        logging.info(f"Upstream pool started (http2={'on' if HTTP2_AVAILABLE else 'off'}): {', '.join(self._clients)}")
+
+    def client(self, name: str) -> httpx.AsyncClient:
+        # lifespan が走らない実行環境 (一部のサーバーレス) では初回利用時に作成します。
+        # 呼び出しごとに新しいイベントループで動かす ASGI ブリッジもあるので、
+        # 作成時と別のループから呼ばれたら古い接続は使わずに作り直します
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(name)
+        if client is None or client.is_closed or self._loops.get(name) is not loop:
+            if client is not None and not client.is_closed:
+                self._discard(name, client)
+            client = self._clients[name] = self._create(name)
+            self._loops[name] = loop
+        return client
+
+    def _discard(self, name: str, client: httpx.AsyncClient) -> None:
+        task = asyncio.get_running_loop().create_task(self._close_stale(name, client))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close_stale(self, name: str, client: httpx.AsyncClient) -> None:
+        try:
+            await client.aclose()
+        except Exception as e:
+            # 元のループが閉じていると接続の後始末で失敗します。接続はプールから外れているので、参照が消えた時点で閉じられます
+            logging.debug(f"Closing stale {name} client from a previous event loop failed: {e}")
+
+    async def aclose(self) -> None:
+        clients, self._clients = self._clients, {}
+        self._loops = {}
+        for client in clients.values():
+            await client.aclose()
+
+
+pool = UpstreamPool()
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    return pool.client(name)
@@ -0,0 +1,123 @@
+# --- コールドスタートのベンチマーク ---
+# 1. python -X importtime で api/index.py を import し、トップレベルのモジュールごとの累積時間を表示
+# 2. 起動時に読み込んではいけない重い SDK が import されていないかを確認
+# 3. uvicorn を新しいプロセスで起動してから、最初のレスポンスが返るまでの時間を計測
+# いずれかがしきい値を超えたら終了コード1で終わるので、CI で回帰を検出できます。
+#
+#   python bench/bench_cold_start.py --runs 5 --max-import-ms 700 --max-first-response-ms 2000
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+
+# これらはリクエストで初めて必要になるまで読み込まない (lazy.py)
+DEFERRED_MODULES = ("google.generativeai", "grpc", "tavily", "vercel_blob", "numpy", "tiktoken")
+
+_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+CHECK_SCRIPT = (
+    "import sys, index; "
+    f"print('DEFERRED:' + ','.join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))"
+)
+
+
+def import_profile() -> tuple[float, dict[str, float], list[str]]:
+    """(index の累積 import 時間 ms, index 直下のモジュール別累積 ms, 読み込まれた重い SDK) を返す。"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHECK_SCRIPT],
+        cwd=API_DIR, capture_output=True, text=True, check=True,
+    )
+    total_ms = 0.0
+    modules = {}
+    children = {}
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME.match(line)
+        if not match:
+            continue
+        cumulative_us, depth, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        # importtime は子モジュールを親より先に出力するので、トップレベルの行で区切って集計します
+        if depth == 0:
+            if name == "index":
+                total_ms = cumulative_us / 1000
+                modules = children
+            children = {}
+        elif depth == 2:
+            children[name] = children.get(name, 0.0) + cumulative_us / 1000
+    loaded = []
+    for line in result.stdout.splitlines():
+        if line.startswith("DEFERRED:"):
+            loaded = [m for m in line[len("DEFERRED:"):].split(",") if m]
+    return total_ms, modules, loaded
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_to_first_response(path: str, timeout: float = 30.0) -> float:
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "index:app", "--port", str(port), "--log-level", "warning"],
+        cwd=API_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=1) as response:
+                    response.read()
+                    return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.005)
+        raise TimeoutError(f"no response from {path} within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="コールドスタートのベンチマーク")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/", help="最初に叩くパス")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--max-import-ms", type=float, default=700.0)
+    parser.add_argument("--max-first-response-ms", type=float, default=2000.0)
+    args = parser.parse_args()
+
+    imports = [import_profile() for _ in range(args.runs)]
+    import_ms = statistics.median(run[0] for run in imports)
+    names = {name for run in imports for name in run[1]}
+    per_module = {name: statistics.median(run[1].get(name, 0.0) for run in imports) for name in names}
+    loaded = sorted({m for run in imports for m in run[2]})
+
+    print(f"import index: {import_ms:.1f} ms (median of {args.runs})")
+    for name, ms in sorted(per_module.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {ms:8.1f} ms  {name}")
+
+    first = statistics.median(time_to_first_response(args.path) for _ in range(args.runs))
+    print(f"time to first response ({args.path}): {first * 1000:.1f} ms (median of {args.runs})")
+
+    failures = []
+    if loaded:
+        failures.append(f"deferred modules imported at startup: {', '.join(loaded)}")
+    if import_ms > args.max_import_ms:
+        failures.append(f"import time {import_ms:.1f} ms > {args.max_import_ms:.0f} ms")
+    if first * 1000 > args.max_first_response_ms:
+        failures.append(f"time to first response {first * 1000:.1f} ms > {args.max_first_response_ms:.0f} ms")
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
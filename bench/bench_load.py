@@ -0,0 +1,495 @@
+# --- 負荷試験 ---
+# 本物の外部APIを使わずに、api/index.py の全エンドポイントのスループットとテールレイテンシを測ります。
+#   - Nominatim / OSRM (車・徒歩) / Open-Meteo / Overpass / Tavily / Vercel Blob: ローカル代替の HTTP サーバー (別プロセス)
+#   - Gemini: ローカル代替の gRPC サーバー (同じ別プロセス)
+# Gemini / Tavily もアプリ内では本物の SDK を使うので、SDK の処理にかかる時間も計測に含まれます。
+# 代替の応答遅延の分布と失敗率は DEFAULT_PROFILE、または --profile の JSON (同じ形で上書き) で指定します。
+# アプリは uvicorn の別プロセスで起動し、エンドポイントを1つずつ順に、ウォームアップの後 --duration 秒間叩きます。
+#   --concurrency N  N 本のワーカーが応答を待ってから次を送る (closed loop)
+#   --rate R         1秒あたり R 件をポアソン到着で送る (open loop)。レイテンシは送るはずだった時刻から数えます
+# エンドポイントごとに p50/p95/p99 レイテンシ、スループット、エラー率、アプリの RSS を表示し、結果を JSON に保存します。
+# --baseline で以前の結果と比べ、悪化していれば終了コード1で終わるので、CI で回帰を検出できます。
+#
+#   python bench/bench_load.py --duration 10 --concurrency 8
+#   python bench/bench_load.py --rate 20 --endpoints /weather/,/create-itinerary/ --baseline bench/results/baseline.json
+#   python bench/bench_load.py --compare bench/results/old.json bench/results/new.json
+import argparse
+import asyncio
+import functools
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+sys.path.append(BENCH_DIR)
+
+from fakes import UPSTREAM_HANDLERS, BlobStore, FakeGeminiService, FaultyHandler
+from stand_in import GeminiStandInServer, StandInServer
+
+# 遅延は公開サーバーを日本から使ったときのおおよその値です
+DEFAULT_PROFILE = {
+    "nominatim": {"latency": "lognormal:0.12:0.4", "failure_rate": 0.01},
+    "osrm": {"latency": "lognormal:0.08:0.5", "failure_rate": 0.005},
+    "osrm_walking": {"latency": "lognormal:0.1:0.5", "failure_rate": 0.005},
+    "open_meteo": {"latency": "lognormal:0.06:0.3", "failure_rate": 0.005},
+    "overpass": {"latency": "lognormal:0.8:0.6", "failure_rate": 0.02},
+    "blob": {"latency": "lognormal:0.05:0.3", "failure_rate": 0.005},
+    "tavily": {"latency": "lognormal:0.6:0.4", "failure_rate": 0.01},
+    "gemini": {"latency": "lognormal:0.5:0.3", "chunk_delay": 0.05, "chunks": 20, "failure_rate": 0.01},
+}
+
+PLACES = [
+    "浅草寺", "東京スカイツリー", "上野動物園", "東京タワー", "明治神宮", "皇居", "築地場外市場", "お台場海浜公園",
+    "新宿御苑", "六本木ヒルズ", "渋谷スクランブル交差点", "東京駅", "国立科学博物館", "代々木公園", "清澄庭園",
+    "浜離宮恩賜庭園", "両国国技館", "豊洲市場", "谷中銀座", "根津神社", "柴又帝釈天", "井の頭公園",
+    "三鷹の森ジブリ美術館", "高尾山", "鎌倉大仏", "鶴岡八幡宮", "横浜中華街", "みなとみらい", "川越", "日光東照宮",
+]
+AREAS = [(35.681, 139.767), (35.714, 139.796), (35.659, 139.700), (34.985, 135.759), (34.702, 135.496), (43.068, 141.351)]
+QUERIES = [f"{place} {topic}" for place in PLACES[:12] for topic in ("混雑", "営業時間", "アクセス")]
+# アップロードする画像の種類。同じ画像が繰り返し送られるので重複排除も効きます
+UPLOAD_IMAGES = 100
+
+
+def random_point(rng: random.Random) -> tuple[float, float]:
+    lat, lon = rng.choice(AREAS)
+    return round(lat + rng.uniform(-0.03, 0.03), 5), round(lon + rng.uniform(-0.03, 0.03), 5)
+
+
+def itinerary_params(rng: random.Random) -> dict:
+    count = rng.randint(2, 4)
+    start_lat, start_lon = random_point(rng)
+    return {
+        "destinations": ",".join(rng.sample(PLACES, count)),
+        "durations": ",".join(str(rng.randrange(30, 121, 15)) for _ in range(count)),
+        "date": "2025-09-10",
+        "start_lat": start_lat,
+        "start_lon": start_lon,
+    }
+
+
+def parking_params(rng: random.Random) -> dict:
+    lat, lon = random_point(rng)
+    return {"lat": lat, "lon": lon}
+
+
+@functools.lru_cache(maxsize=UPLOAD_IMAGES)
+def image_bytes(image_id: int, size: int) -> bytes:
+    return random.Random(image_id).randbytes(size)
+
+
+def upload_request(rng: random.Random, args) -> dict:
+    image_id = rng.randrange(UPLOAD_IMAGES)
+    data = image_bytes(image_id, args.upload_kb * 1024)
+    return {"method": "POST", "url": "/upload-image/", "files": {"file": (f"photo-{image_id}.jpg", data, "image/jpeg")}}
+
+
+def get(url: str, params=None):
+    return lambda rng, args: {"method": "GET", "url": url, "params": params(rng) if params else None}
+
+
+# api/index.py のエンドポイントごとの、リクエストの作り方
+ENDPOINTS = {
+    "/": get("/"),
+    "/weather/": get("/weather/", lambda rng: dict(zip(("latitude", "longitude"), random_point(rng)))),
+    "/ai-search/": get("/ai-search/", lambda rng: {"query": rng.choice(QUERIES)}),
+    "/ai-search/stream": get("/ai-search/stream", lambda rng: {"query": rng.choice(QUERIES)}),
+    "/create-itinerary/": get("/create-itinerary/", itinerary_params),
+    "/create-itinerary/stream": get("/create-itinerary/stream", itinerary_params),
+    "/nearby-parking/": get("/nearby-parking/", parking_params),
+    "/nearby-parking/stream": get("/nearby-parking/stream", parking_params),
+    "/upload-image/": upload_request,
+    "/metrics": get("/metrics"),
+}
+
+
+# --- 代替サーバーとアプリの起動 ---
+def serve_upstreams(conn, profile: dict, seed: int) -> None:
+    # 代替サーバーの処理がアプリや負荷生成側の計測に混ざらないよう、別プロセスで動かします
+    async def serve():
+        urls = {}
+        for name, handler in {**UPSTREAM_HANDLERS, "blob": BlobStore()}.items():
+            settings = profile.get(name, {})
+            faulty = FaultyHandler(handler, settings.get("latency", 0.0), settings.get("failure_rate", 0.0), seed=f"{seed}:{name}")
+            urls[name] = (await StandInServer(faulty).start()).base_url
+        gemini = profile.get("gemini", {})
+        service = FakeGeminiService(
+            chunks=gemini.get("chunks", 20),
+            first_token=gemini.get("latency", 0.4),
+            chunk_delay=gemini.get("chunk_delay", 0.05),
+            failure_rate=gemini.get("failure_rate", 0.0),
+            seed=f"{seed}:gemini",
+        )
+        urls["gemini"] = (await GeminiStandInServer(service).start()).endpoint
+        conn.send(urls)
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_app(urls: dict, workdir: str, timeout: float = 30.0):
+    port = free_port()
+    env = {
+        **os.environ,
+        "OPEN_METEO_BASE_URL": urls["open_meteo"],
+        "NOMINATIM_BASE_URL": urls["nominatim"],
+        "OSRM_BASE_URL": urls["osrm"],
+        "OSRM_WALKING_BASE_URL": urls["osrm_walking"],
+        "OVERPASS_BASE_URL": urls["overpass"],
+        "TAVILY_BASE_URL": urls["tavily"],
+        "TAVILY_API_KEY": "tvly-standin",
+        "GEMINI_API_ENDPOINT": urls["gemini"],
+        "GEMINI_API_KEY": "standin",
+        "BLOB_BASE_URL": urls["blob"],
+        "BLOB_READ_WRITE_TOKEN": "vercel_blob_rw_standin_token",
+        # 毎回空のキャッシュから始めて、実行ごとの条件をそろえます
+        "GEOCODE_CACHE_PATH": os.path.join(workdir, "geocode.sqlite3"),
+    }
+    env.pop("PARKING_SNAPSHOT_PATH", None)
+    # 代替サーバー相手なので Nominatim の利用規約のための 1 req/s 制限は外します
+    env.setdefault("NOMINATIM_RATE_PER_SECOND", "1000")
+    log = open(os.path.join(workdir, "app.log"), "w+")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "load_app:app", "--app-dir", BENCH_DIR,
+         "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    with log:
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            while time.perf_counter() - started < timeout:
+                if server.poll() is not None:
+                    break
+                try:
+                    if (await client.get("/")).status_code == 200:
+                        return server, base_url
+                except httpx.TransportError:
+                    await asyncio.sleep(0.05)
+        server.kill()
+        log.seek(0)
+        raise RuntimeError(f"app did not start:\n{log.read()[-2000:]}")
+
+
+# --- 計測 ---
+def rss_bytes(pid: int) -> int | None:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # /proc が無い環境 (macOS) では ps で取ります
+    try:
+        result = subprocess.run(["ps", "-o", "rss=", "-p", str(pid)], capture_output=True, text=True, check=True)
+        return int(result.stdout) * 1024
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return None
+
+
+async def sample_rss(pid: int, samples: list, stop: asyncio.Event, interval: float = 0.1) -> None:
+    while True:
+        rss = rss_bytes(pid)
+        if rss is not None:
+            samples.append(rss)
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+            return
+        except asyncio.TimeoutError:
+            pass
+
+
+async def send(client: httpx.AsyncClient, request: dict, scheduled: float) -> tuple[float, float | None, bool]:
+    """(レイテンシ, 最初のバイトまでの時間, 成功したか) を返す。SSE の error イベントも失敗として数える。"""
+    first_byte = None
+    ok = False
+    try:
+        async with client.stream(**request) as response:
+            error_event = False
+            tail = b""
+            async for chunk in response.aiter_raw():
+                if first_byte is None:
+                    first_byte = time.perf_counter() - scheduled
+                # チャンクの境目で分かれていても見つけられるように、前のチャンクの末尾とつなげて探します
+                error_event = error_event or b"event: error" in tail + chunk
+                tail = chunk[-16:]
+            ok = response.status_code < 400 and not error_event
+    except httpx.HTTPError:
+        pass
+    return time.perf_counter() - scheduled, first_byte, ok
+
+
+async def closed_loop(fire, concurrency: int, duration: float) -> None:
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            await fire(time.perf_counter())
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def open_loop(fire, rate: float, duration: float, rng: random.Random) -> None:
+    started = scheduled = time.perf_counter()
+    tasks = []
+    while scheduled < started + duration:
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        # 応答が遅れても送信を待たせないので、遅れはそのままレイテンシに表れます
+        tasks.append(asyncio.create_task(fire(scheduled)))
+        scheduled += rng.expovariate(rate)
+    await asyncio.gather(*tasks)
+
+
+def percentile(sorted_values: list, q: float) -> float | None:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))]
+
+
+def to_ms(seconds: float | None) -> float | None:
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def to_mb(size: int | None) -> float | None:
+    return None if size is None else round(size / 1024 / 1024, 1)
+
+
+def summarize(samples: list, elapsed: float, rss: list) -> dict:
+    latencies = sorted(s[0] for s in samples)
+    first_bytes = sorted(s[1] for s in samples if s[1] is not None)
+    errors = sum(1 for s in samples if not s[2])
+    return {
+        "requests": len(samples),
+        "rps": round(len(samples) / elapsed, 2) if elapsed > 0 else 0.0,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "p50_ms": to_ms(percentile(latencies, 50)),
+        "p95_ms": to_ms(percentile(latencies, 95)),
+        "p99_ms": to_ms(percentile(latencies, 99)),
+        "max_ms": to_ms(latencies[-1] if latencies else None),
+        "ttfb_p50_ms": to_ms(percentile(first_bytes, 50)),
+        "rss_start_mb": to_mb(rss[0] if rss else None),
+        "rss_peak_mb": to_mb(max(rss) if rss else None),
+        "rss_end_mb": to_mb(rss[-1] if rss else None),
+    }
+
+
+async def run_endpoint(client: httpx.AsyncClient, name: str, args, pid: int) -> dict:
+    # パラメーターと到着間隔の乱数はエンドポイントごとに固定し、実行ごとに同じリクエスト列にします
+    rng = random.Random(f"{args.seed}:{name}")
+    arrivals = random.Random(f"{args.seed}:{name}:arrivals")
+    samples = []
+    recording = False
+
+    async def fire(scheduled: float) -> None:
+        record = recording
+        result = await send(client, ENDPOINTS[name](rng, args), scheduled)
+        if record:
+            samples.append(result)
+
+    async def load(duration: float) -> None:
+        if args.rate:
+            await open_loop(fire, args.rate, duration, arrivals)
+        else:
+            await closed_loop(fire, args.concurrency, duration)
+
+    if args.warmup > 0:
+        await load(args.warmup)
+
+    recording = True
+    rss = []
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(pid, rss, stop))
+    started = time.perf_counter()
+    await load(args.duration)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await sampler
+    return summarize(samples, elapsed, rss)
+
+
+def git_commit() -> str | None:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# --- 表示と比較 ---
+def fmt(value, width: int = 8, digits: int = 1) -> str:
+    return f"{'-':>{width}}" if value is None else f"{value:>{width}.{digits}f}"
+
+
+def print_report(endpoints: dict) -> None:
+    print(f"{'endpoint':<26} {'reqs':>6} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'ttfb ms':>8} {'err %':>6} {'rss MB':>8}")
+    for name, stats in endpoints.items():
+        print(f"{name:<26} {stats['requests']:>6} {fmt(stats['rps'])} {fmt(stats['p50_ms'])} {fmt(stats['p95_ms'])} "
+              f"{fmt(stats['p99_ms'])} {fmt(stats['ttfb_p50_ms'])} {fmt(stats['error_rate'] * 100, 6)} {fmt(stats['rss_peak_mb'])}")
+
+
+# (指標, 大きいほど悪いか, 変化量がこれ以下なら誤差として無視する値)
+COMPARED = (
+    ("p50_ms", True, 5.0),
+    ("p95_ms", True, 5.0),
+    ("p99_ms", True, 5.0),
+    ("rps", False, 0.5),
+    ("rss_peak_mb", True, 5.0),
+)
+
+
+def compare(baseline: dict, current: dict, tolerance: float, error_tolerance: float) -> list[str]:
+    """悪化した指標を表示し、その一覧を返す。"""
+    if baseline.get("config") != current.get("config"):
+        print("warning: the runs used different settings (config); the comparison may not be meaningful", file=sys.stderr)
+
+    regressions = []
+    print(f"baseline {baseline.get('created')} ({baseline.get('commit')}) -> current {current.get('created')} ({current.get('commit')})")
+    print(f"{'endpoint':<26} {'metric':<12} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, stats in current["endpoints"].items():
+        base = baseline["endpoints"].get(name)
+        if base is None:
+            continue
+        for key, higher_is_worse, noise in COMPARED:
+            old, new = base.get(key), stats.get(key)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else 0.0
+            worse = new - old if higher_is_worse else old - new
+            regressed = worse > noise and worse > abs(old) * tolerance
+            if regressed:
+                regressions.append(f"{name} {key}: {old} -> {new}")
+            print(f"{name:<26} {key:<12} {old:>10} {new:>10} {change * 100:>+7.1f}%{'  REGRESSION' if regressed else ''}")
+        old, new = base.get("error_rate", 0.0), stats.get("error_rate", 0.0)
+        regressed = new - old > error_tolerance
+        if regressed:
+            regressions.append(f"{name} error_rate: {old} -> {new}")
+        print(f"{name:<26} {'error_rate':<12} {old:>10} {new:>10} {(new - old) * 100:>+6.1f}pt{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def load_profile(path: str | None) -> dict:
+    profile = {name: dict(settings) for name, settings in DEFAULT_PROFILE.items()}
+    if path:
+        with open(path, encoding="utf-8") as f:
+            for name, settings in json.load(f).items():
+                profile.setdefault(name, {}).update(settings)
+    return profile
+
+
+async def run(args) -> dict:
+    names = args.endpoints.split(",") if args.endpoints else list(ENDPOINTS)
+    unknown = [name for name in names if name not in ENDPOINTS]
+    if unknown:
+        raise SystemExit(f"unknown endpoints: {', '.join(unknown)} (choose from {', '.join(ENDPOINTS)})")
+    profile = load_profile(args.profile)
+    if args.failure_rate is not None:
+        for settings in profile.values():
+            settings["failure_rate"] = args.failure_rate
+
+    parent, child = multiprocessing.Pipe()
+    upstreams = multiprocessing.Process(target=serve_upstreams, args=(child, profile, args.seed), daemon=True)
+    upstreams.start()
+    urls = parent.recv()
+
+    endpoints = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        server, base_url = await start_app(urls, workdir)
+        try:
+            limits = httpx.Limits(max_connections=None, max_keepalive_connections=max(args.concurrency, 100))
+            async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+                for name in names:
+                    endpoints[name] = await run_endpoint(client, name, args, server.pid)
+                    stats = endpoints[name]
+                    print(f"  {name}: {stats['requests']} requests, p95 {stats['p95_ms']} ms", file=sys.stderr)
+        finally:
+            server.terminate()
+            server.wait()
+            upstreams.terminate()
+
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "mode": "open" if args.rate else "closed",
+            "rate": args.rate,
+            "concurrency": None if args.rate else args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "seed": args.seed,
+            "upload_kb": args.upload_kb,
+            "profile": profile,
+        },
+        "endpoints": endpoints,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ローカル代替サーバーを使った負荷試験")
+    parser.add_argument("--endpoints", help="カンマ区切りで対象を絞る (既定: 全エンドポイント)")
+    parser.add_argument("--duration", type=float, default=10.0, help="エンドポイントごとの計測時間 (秒)")
+    parser.add_argument("--warmup", type=float, default=2.0, help="計測前に負荷をかける時間 (秒)")
+    parser.add_argument("--concurrency", type=int, default=8, help="closed loop の同時リクエスト数")
+    parser.add_argument("--rate", type=float, help="open loop で送る 1秒あたりのリクエスト数")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--upload-kb", type=int, default=256, help="/upload-image/ で送る画像の大きさ")
+    parser.add_argument("--profile", help="DEFAULT_PROFILE を上書きする遅延・失敗率の JSON ファイル")
+    parser.add_argument("--failure-rate", type=float, help="全代替の失敗率をこの値にそろえる")
+    parser.add_argument("--out", help="結果の保存先 (既定: bench/results/load-<日時>.json)")
+    parser.add_argument("--baseline", help="比べる以前の結果 (JSON)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="負荷はかけず、保存済みの2つの結果を比べる")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="レイテンシ・スループット・メモリの悪化をどこまで許すか (割合)")
+    parser.add_argument("--error-tolerance", type=float, default=0.01, help="エラー率の増加をどこまで許すか (絶対値)")
+    args = parser.parse_args()
+
+    if args.compare:
+        runs = []
+        for path in args.compare:
+            with open(path, encoding="utf-8") as f:
+                runs.append(json.load(f))
+        regressions = compare(*runs, args.tolerance, args.error_tolerance)
+    else:
+        result = asyncio.run(run(args))
+        print_report(result["endpoints"])
+
+        out = args.out or os.path.join(RESULTS_DIR, f"load-{datetime.now():%Y%m%d-%H%M%S}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"saved results to {out}")
+
+        regressions = []
+        if args.baseline:
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+            regressions = compare(baseline, result, args.tolerance, args.error_tolerance)
+
+    for regression in regressions:
+        print(f"REGRESSION: {regression}", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# --- SSE ストリーミングの TTFB ベンチマーク ---
+# uvicorn でアプリを起動し、外部APIはローカル代替 / Gemini はチャンクを遅れて返す偽物に差し替えて、
+# 従来のバッファリング版と /stream 版の「最初の1バイトまでの時間」と「全体の時間」を比べます。
+#
+#   python bench/bench_streaming_ttfb.py --runs 5
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import httpx
+import uvicorn
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BENCH_DIR)
+sys.path.append(os.path.join(BENCH_DIR, "..", "api"))
+from fakes import FakeGemini, FakeTavily, upstream_handler
+from stand_in import StandInServer
+
+ITINERARY = {
+    "destinations": "浅草寺,東京スカイツリー,上野動物園",
+    "durations": "60,45,90",
+    "date": "2025-09-10",
+    "start_lat": 35.6812,
+    "start_lon": 139.7671,
+}
+CASES = [
+    ("/ai-search/", {"query": "東京 観光 おすすめ"}),
+    ("/create-itinerary/", ITINERARY),
+    ("/nearby-parking/", {"lat": 35.68, "lon": 139.76}),
+]
+
+
+async def time_request(client: httpx.AsyncClient, path: str, params: dict) -> tuple[float, float]:
+    started = time.perf_counter()
+    first_byte = None
+    async with client.stream("GET", path, params=params) as response:
+        response.raise_for_status()
+        async for _ in response.aiter_raw():
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+    return first_byte, time.perf_counter() - started
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="SSE ストリーミングの TTFB ベンチマーク")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    async with StandInServer(upstream_handler) as upstreams:
+        for name in ("OPEN_METEO", "NOMINATIM", "OSRM", "OSRM_WALKING", "OVERPASS"):
+            os.environ[f"{name}_BASE_URL"] = upstreams.base_url
+        os.environ.setdefault("NOMINATIM_RATE_PER_SECOND", "1000")
+        os.environ.setdefault("GEOCODE_CACHE_PATH", ":memory:")
+        # 回答キャッシュに当たると Gemini を呼ばなくなるので、ここでは無効にします
+        os.environ.setdefault("SEARCH_CACHE_TTL_SECONDS", "0")
+        import index
+
+        index.model = FakeGemini()
+        index.tavily = FakeTavily()
+
+        server = uvicorn.Server(uvicorn.Config(index.app, port=args.port, log_level="warning"))
+        serving = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.05)
+
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=60.0) as client:
+                print(f"{'endpoint':<28} {'ttfb p50':>10} {'total p50':>10}")
+                for path, params in CASES:
+                    for variant in (path, f"{path}stream"):
+                        samples = [await time_request(client, variant, params) for _ in range(args.runs)]
+                        ttfb = statistics.median(s[0] for s in samples)
+                        total = statistics.median(s[1] for s in samples)
+                        print(f"{variant:<28} {ttfb * 1000:>8.0f}ms {total * 1000:>8.0f}ms")
+        finally:
+            server.should_exit = True
+            await serving
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
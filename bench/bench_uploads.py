@@ -0,0 +1,120 @@
+# --- 画像アップロードのベンチマーク ---
+# ローカルの代替 Blob サーバー (別プロセス) に対して、
+#   legacy:   await file.read() で全体を読み、vercel_blob.put をイベントループ上で呼ぶ旧方式
+#   pipeline: uploads.Uploader (チャンク読み込み + スレッドプール + multipart 並列 + 重複排除)
+# を同時アップロードで比べ、ピークメモリ・スループット・イベントループの最大停止時間を表示します。
+#
+#   python bench/bench_uploads.py --files 8 --size-mb 20
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BENCH_DIR)
+sys.path.append(os.path.join(BENCH_DIR, "..", "api"))
+os.environ.setdefault("BLOB_READ_WRITE_TOKEN", "vercel_blob_rw_standin_token")
+
+from starlette.datastructures import UploadFile
+from vercel_blob import blob_store
+
+from fakes import BlobStore
+from stand_in import StandInServer
+from uploads import Uploader
+
+
+def serve_blobs(conn) -> None:
+    # 受信側のメモリを計測に含めないよう、代替サーバーは子プロセスで動かします
+    async def serve():
+        server = await StandInServer(BlobStore()).start()
+        conn.send(server.base_url)
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+def bytes_received(base_url: str) -> int:
+    with urllib.request.urlopen(f"{base_url}/_stats") as response:
+        return json.load(response)["bytes_received"]
+
+
+def make_upload_files(count: int, size: int, seed: bytes) -> list[UploadFile]:
+    """FastAPI が渡すのと同じ、ディスクに退避済みの UploadFile を作る。"""
+    files = []
+    for i in range(count):
+        spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        block = seed + i.to_bytes(4, "big") + os.urandom(1024 * 1024 - len(seed) - 4)
+        for _ in range(size // len(block)):
+            spooled.write(block)
+        spooled.seek(0)
+        files.append(UploadFile(spooled, size=size, filename=f"photo-{i}.jpg"))
+    return files
+
+
+async def legacy_upload(file: UploadFile) -> dict:
+    contents = await file.read()
+    return blob_store.put(file.filename, contents, options={'add_random_suffix': True, 'access': 'public'})
+
+
+async def loop_lag(stop: asyncio.Event, interval: float = 0.01) -> float:
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - started - interval)
+    return worst
+
+
+async def measure(label: str, upload, files, base_url: str) -> None:
+    received = bytes_received(base_url)
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(loop_lag(stop))
+    tracemalloc.start()
+    started = time.perf_counter()
+    results = await asyncio.gather(*(upload(file) for file in files))
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stop.set()
+    lag = await lag_task
+
+    total_mb = sum(file.size for file in files) / 1024 / 1024
+    dedup = sum(1 for r in results if r.get("deduplicated"))
+    print(f"{label:<16} elapsed={elapsed:6.2f}s throughput={total_mb / elapsed:7.1f} MB/s "
+          f"peak_mem={peak / 1024 / 1024:7.1f} MB max_loop_stall={lag * 1000:7.1f} ms "
+          f"sent={(bytes_received(base_url) - received) / 1024 / 1024:7.1f} MB dedup={dedup}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="画像アップロードのベンチマーク")
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--size-mb", type=int, default=20)
+    args = parser.parse_args()
+    size = args.size_mb * 1024 * 1024
+
+    parent, child = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve_blobs, args=(child,), daemon=True)
+    server.start()
+    base_url = parent.recv()
+    blob_store._VERCEL_BLOB_API_BASE_URL = base_url
+    uploader = Uploader()
+    try:
+        await measure("legacy", legacy_upload, make_upload_files(args.files, size, b"legacy"), base_url)
+        files = make_upload_files(args.files, size, b"pipeline")
+        await measure("pipeline", uploader.upload, files, base_url)
+        for file in files:
+            await file.seek(0)
+        await measure("pipeline (dup)", uploader.upload, files, base_url)
+    finally:
+        uploader.shutdown()
+        server.terminate()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
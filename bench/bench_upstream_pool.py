@@ -0,0 +1,75 @@
+# --- 共有HTTPクライアントのベンチマーク ---
+# ローカルの代替サーバーに対して「リクエストごとに AsyncClient を作る旧方式」と
+# 「UpstreamPool で使い回す新方式」を比べ、TCP接続数 (=ハンドシェイク数) とスループットを表示します。
+#
+#   python bench/bench_upstream_pool.py --requests 500 --concurrency 20
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from stand_in import StandInServer
+from upstream import Upstream, UpstreamPool
+
+FORECAST = {"daily": {"temperature_2m_max": [25.0], "precipitation_probability_max": [10]}}
+
+
+def forecast_handler(method, path, query, body, headers):
+    return 200, FORECAST
+
+
+async def run_per_request(base_url: str, total: int, concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            async with httpx.AsyncClient() as client:
+                response = await client.get(f"{base_url}/v1/forecast", params={"latitude": 35.68, "longitude": 139.76})
+                response.raise_for_status()
+
+    await asyncio.gather(*(one() for _ in range(total)))
+
+
+async def run_pooled(base_url: str, total: int, concurrency: int) -> None:
+    upstream = Upstream(base_url=base_url, connect_timeout=3.0, read_timeout=10.0, max_connections=concurrency)
+    pool = UpstreamPool({"open_meteo": upstream})
+    await pool.start()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            response = await pool.client("open_meteo").get("/v1/forecast", params={"latitude": 35.68, "longitude": 139.76})
+            response.raise_for_status()
+
+    try:
+        await asyncio.gather(*(one() for _ in range(total)))
+    finally:
+        await pool.aclose()
+
+
+async def measure(label: str, runner, total: int, concurrency: int) -> None:
+    async with StandInServer(forecast_handler) as server:
+        started = time.perf_counter()
+        await runner(server.base_url, total, concurrency)
+        elapsed = time.perf_counter() - started
+    print(f"{label:<12} connections={server.connections:<5} requests={server.requests:<5} "
+          f"elapsed={elapsed:.3f}s throughput={total / elapsed:.1f} req/s")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="共有HTTPクライアントのベンチマーク")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    await measure("per-request", run_per_request, args.requests, args.concurrency)
+    await measure("pooled", run_pooled, args.requests, args.concurrency)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
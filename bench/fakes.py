@@ -0,0 +1,295 @@
+# --- ベンチマーク用の外部API代替 ---
+# Nominatim / OSRM / Open-Meteo / Overpass / Tavily / Vercel Blob は StandInServer の handler として、
+# Gemini は GeminiStandInServer (gRPC) に渡す FakeGeminiService として用意します。
+# SDK を通さずに api/index.py の model / tavily と直接差し替える FakeGemini / FakeTavily もあります。
+# FaultyHandler と各 Fake の latency / failure_rate で、応答の遅延の分布と失敗率を指定できます。
+import asyncio
+import json
+import math
+import random
+import re
+
+_BBOX = re.compile(r"\(([-\d.]+),([-\d.]+),([-\d.]+),([-\d.]+)\)")
+# Overpass の代替が返す駐車場の密度 (1平方度あたり)。都心部でタイル1枚に数十件程度
+PARKING_LOTS_PER_SQUARE_DEGREE = 30000
+
+
+class Latency:
+    """遅延の分布。"fixed:0.05" / "uniform:0.02:0.1" / "normal:0.1:0.02" / "lognormal:0.08:0.5" / "exponential:0.1" の形式 (秒)。
+
+    lognormal は中央値と σ、数値だけを渡した場合は固定値です。
+    """
+
+    KINDS = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exponential": 1}
+
+    def __init__(self, spec):
+        if isinstance(spec, Latency):
+            spec = spec.spec
+        if isinstance(spec, (int, float)):
+            spec = f"fixed:{spec}"
+        kind, *params = spec.split(":")
+        if self.KINDS.get(kind) != len(params):
+            raise ValueError(f"invalid latency spec: {spec!r}")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(p) for p in params]
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return rng.uniform(*self.params)
+        if self.kind == "normal":
+            return max(0.0, rng.gauss(*self.params))
+        if self.kind == "lognormal":
+            median, sigma = self.params
+            return rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+        return rng.expovariate(1 / self.params[0]) if self.params[0] > 0 else 0.0
+
+    def __repr__(self) -> str:
+        return f"Latency({self.spec!r})"
+
+
+class FakeUpstreamError(Exception):
+    pass
+
+
+class FaultyHandler:
+    """handler の前に遅延を入れ、failure_rate の割合で 503 を返す。"""
+
+    def __init__(self, handler, latency=0.0, failure_rate: float = 0.0, seed=None):
+        self.handler = handler
+        self.latency = Latency(latency)
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.failures = 0
+
+    async def __call__(self, method, path, query, body, headers):
+        await asyncio.sleep(self.latency.sample(self.rng))
+        if self.rng.random() < self.failure_rate:
+            self.failures += 1
+            return 503, {"message": "injected failure"}
+        result = self.handler(method, path, query, body, headers)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+
+def nominatim_handler(method, path, query, body, headers):
+    if path != "/search":
+        return 404, {"message": "not found"}
+    rng = random.Random(query.get("q", [""])[0])
+    return 200, [{"lat": str(35.68 + rng.uniform(-0.05, 0.05)), "lon": str(139.76 + rng.uniform(-0.05, 0.05))}]
+
+
+def _road_distance_m(a, b) -> float:
+    # 直線距離に道なりの分の係数を掛けた、おおよその道のり
+    lon1, lat1, lon2, lat2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 1.3 * 2 * 6371008.8 * math.asin(math.sqrt(h))
+
+
+def make_osrm_handler(speed_mps: float):
+    """OSRM /table の代わり。本物と同じく、URL のプロファイル名は無視してサーバーの速さで答える。"""
+
+    def handler(method, path, query, body, headers):
+        if not path.startswith("/table/v1/"):
+            return 404, {"message": "not found"}
+        coords = [tuple(map(float, c.split(","))) for c in path.rsplit("/", 1)[-1].split(";")]
+        distances = [[round(_road_distance_m(a, b), 1) for b in coords] for a in coords]
+        result = {"code": "Ok", "durations": [[round(d / speed_mps, 1) for d in row] for row in distances]}
+        if "distance" in query.get("annotations", [""])[0]:
+            result["distances"] = distances
+        return 200, result
+
+    return handler
+
+
+# 公開デモサーバーと同じ車のプロファイル (市街地で平均 30km/h 程度) と、徒歩プロファイル (4.8km/h)
+osrm_handler = make_osrm_handler(30 / 3.6)
+osrm_walking_handler = make_osrm_handler(4.8 / 3.6)
+
+
+def open_meteo_handler(method, path, query, body, headers):
+    if path != "/v1/forecast":
+        return 404, {"message": "not found"}
+    return 200, {"daily": {"time": ["2025-09-10"], "weathercode": [1], "temperature_2m_max": [27.5], "temperature_2m_min": [21.0], "precipitation_probability_max": [20]}}
+
+
+def overpass_handler(method, path, query, body, headers):
+    """問い合わせの bbox の中に、bbox ごとに決まった配置の駐車場を返す。"""
+    if path != "/api/interpreter":
+        return 404, {"message": "not found"}
+    match = _BBOX.search(query.get("data", [""])[0])
+    if match is None:
+        return 400, {"message": "bbox is required"}
+    south, west, north, east = (float(v) for v in match.groups())
+    rng = random.Random(match.group(0))
+    count = min(2000, round((north - south) * (east - west) * PARKING_LOTS_PER_SQUARE_DEGREE))
+    return 200, {"elements": [
+        {"type": "node", "id": rng.getrandbits(48), "lat": rng.uniform(south, north), "lon": rng.uniform(west, east), "tags": {"name": f"P{i}"}}
+        for i in range(count)
+    ]}
+
+
+def search_results(query: str) -> dict:
+    return {"query": query, "results": [{"title": f"{query} {i}", "url": f"https://example.com/{i}", "content": f"{query} についての記事 {i}"} for i in range(5)]}
+
+
+def tavily_handler(method, path, query, body, headers):
+    """Tavily の POST /search の代わり (AsyncTavilyClient の api_base_url に指定する)。"""
+    if method != "POST" or path != "/search":
+        return 404, {"detail": {"error": "not found"}}
+    request = json.loads(body or b"{}")
+    return 200, {**search_results(request.get("query", "")), "answer": None, "images": [], "response_time": 0.0}
+
+
+UPSTREAM_HANDLERS = {
+    "nominatim": nominatim_handler,
+    "osrm": osrm_handler,
+    "osrm_walking": osrm_walking_handler,
+    "open_meteo": open_meteo_handler,
+    "overpass": overpass_handler,
+    "tavily": tavily_handler,
+}
+
+
+def upstream_handler(method, path, query, body, headers):
+    """地図・天気系の外部APIを1つのサーバーでまとめて真似る handler。
+
+    OSRM は車のプロファイルだけなので、徒歩の行列も車と同じになります (公開デモサーバーと同じ状況)。
+    """
+    if path == "/search":
+        return nominatim_handler(method, path, query, body, headers)
+    if path.startswith("/table/v1/"):
+        return osrm_handler(method, path, query, body, headers)
+    if path == "/v1/forecast":
+        return open_meteo_handler(method, path, query, body, headers)
+    if path == "/api/interpreter":
+        return overpass_handler(method, path, query, body, headers)
+    return 404, {"message": "not found"}
+
+
+class BlobStore:
+    """Vercel Blob API (put / list / multipart) の代わりになる handler。
+
+    中身は保持せずサイズだけを記録します。GET /_stats で受信バイト数を返します。
+    """
+
+    def __init__(self):
+        self.blobs = {}
+        self.parts = {}
+        self.bytes_received = 0
+
+    def url_for(self, pathname: str) -> str:
+        return f"https://stand-in.public.blob.vercel-storage.com/{pathname}"
+
+    def __call__(self, method, path, query, body, headers):
+        self.bytes_received += len(body)
+        pathname = query.get("pathname", [""])[0]
+        if method == "GET" and path == "/_stats":
+            return 200, {"bytes_received": self.bytes_received, "blobs": len(self.blobs)}
+        if method == "GET" and path == "/":
+            prefix = query.get("prefix", [""])[0]
+            return 200, {"blobs": [{"pathname": p, "url": self.url_for(p), "size": size} for p, size in self.blobs.items() if p.startswith(prefix)]}
+        if method == "PUT" and path == "/":
+            self.blobs[pathname] = len(body)
+            return 200, {"pathname": pathname, "url": self.url_for(pathname)}
+        if method == "POST" and path == "/mpu":
+            action = headers.get("x-mpu-action")
+            if action == "create":
+                upload_id = f"upload-{len(self.parts)}"
+                self.parts[upload_id] = {}
+                return 200, {"uploadId": upload_id, "key": pathname}
+            upload_id = headers.get("x-mpu-upload-id")
+            if action == "upload":
+                part_number = int(headers["x-mpu-part-number"])
+                self.parts[upload_id][part_number] = len(body)
+                return 200, {"etag": f"etag-{part_number}"}
+            if action == "complete":
+                parts = self.parts.pop(upload_id)
+                self.blobs[pathname] = sum(parts.values())
+                return 200, {"pathname": pathname, "url": self.url_for(pathname)}
+        return 404, {"message": "not found"}
+
+
+class FakeChunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeStream:
+    def __init__(self, chunks, delay: float):
+        self._chunks = chunks
+        self._delay = delay
+
+    async def __aiter__(self):
+        for chunk in self._chunks:
+            await asyncio.sleep(self._delay)
+            yield FakeChunk(chunk)
+
+
+class FakeGemini:
+    """generate_content_async(prompt, stream=...) だけを持つ Gemini の代わり。
+
+    first_token (秒、または Latency の指定) 後に最初のチャンク、その後 chunk_delay 秒ごとに残りのチャンクを返します。
+    failure_rate の割合で、生成を始める前に FakeUpstreamError を送出します。
+    """
+
+    def __init__(self, chunks: int = 20, first_token=0.4, chunk_delay: float = 0.1, failure_rate: float = 0.0, seed=None):
+        self.chunks = [f"回答の一部{i}。" for i in range(chunks)]
+        self.first_token = Latency(first_token)
+        self.chunk_delay = chunk_delay
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+
+    async def generate_content_async(self, prompt, stream: bool = False):
+        await asyncio.sleep(max(0.0, self.first_token.sample(self.rng) - self.chunk_delay))
+        if self.rng.random() < self.failure_rate:
+            raise FakeUpstreamError("injected Gemini failure")
+        if stream:
+            return FakeStream(self.chunks, self.chunk_delay)
+        await asyncio.sleep(self.chunk_delay * len(self.chunks))
+        return FakeChunk("".join(self.chunks))
+
+
+class FakeGeminiService:
+    """GeminiStandInServer に渡す、Gemini の生成処理の代わり。遅延と失敗率は FakeGemini と同じ意味。"""
+
+    def __init__(self, chunks: int = 20, first_token=0.4, chunk_delay: float = 0.1, failure_rate: float = 0.0, seed=None):
+        self.chunks = [f"回答の一部{i}。" for i in range(chunks)]
+        self.first_token = Latency(first_token)
+        self.chunk_delay = chunk_delay
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.failures = 0
+
+    async def _start(self) -> None:
+        await asyncio.sleep(max(0.0, self.first_token.sample(self.rng) - self.chunk_delay))
+        if self.rng.random() < self.failure_rate:
+            self.failures += 1
+            raise FakeUpstreamError("injected Gemini failure")
+
+    async def generate_content(self) -> str:
+        await self._start()
+        await asyncio.sleep(self.chunk_delay * len(self.chunks))
+        return "".join(self.chunks)
+
+    async def stream_generate_content(self):
+        await self._start()
+        for chunk in self.chunks:
+            await asyncio.sleep(self.chunk_delay)
+            yield chunk
+
+
+class FakeTavily:
+    def __init__(self, delay=0.2, failure_rate: float = 0.0, seed=None):
+        self.delay = Latency(delay)
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+
+    async def search(self, query, **kwargs):
+        await asyncio.sleep(self.delay.sample(self.rng))
+        if self.rng.random() < self.failure_rate:
+            raise FakeUpstreamError("injected Tavily failure")
+        return search_results(query)
@@ -0,0 +1,20 @@
+# --- 負荷試験用のアプリ起動モジュール ---
+# api/index.py をそのまま読み込み、Vercel Blob の接続先をローカル代替に差し替えた app を公開します。
+# bench/bench_load.py が uvicorn の別プロセスで起動します。
+#   BLOB_BASE_URL  Vercel Blob 代替の URL (vercel_blob は接続先を環境変数で変えられないため、ここで差し替えます)
+# そのほかの接続先は環境変数で渡し、本物の SDK・HTTP クライアントのまま代替サーバーに接続します。
+#   地図・天気系: upstream.py が読む *_BASE_URL
+#   Gemini: GEMINI_API_ENDPOINT (gRPC)、Tavily: TAVILY_BASE_URL
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCH_DIR, "..", "api"))
+
+from vercel_blob import blob_store
+
+import index
+
+blob_store._VERCEL_BLOB_API_BASE_URL = os.environ["BLOB_BASE_URL"]
+
+app = index.app
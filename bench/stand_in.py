@@ -0,0 +1,170 @@
+# --- ベンチマーク用のローカル代替サーバー ---
+# 本物の外部APIの代わりに固定のJSONを返す、最小限の HTTP/1.1 (keep-alive 対応) サーバーです。
+# 受け付けたTCP接続数を数えるので、ハンドシェイク回数の比較に使えます。
+# Gemini は SDK の非同期 API が gRPC でしか動かないので、GeminiStandInServer (gRPC, TLS なし) で代替します。
+import asyncio
+import json
+from urllib.parse import urlsplit, parse_qs
+
+
+class StandInServer:
+    """handler(method, path, query, body, headers) -> (status, dict | bytes) を受け取って動くサーバー。"""
+
+    def __init__(self, handler, host: str = "127.0.0.1", port: int = 0):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self.requests = 0
+        self._server = None
+        self._connections = {}
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> "StandInServer":
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # keep-alive で残っている接続も閉じてから終了します
+            for writer in list(self._connections):
+                writer.close()
+            await asyncio.gather(*self._connections.values(), return_exceptions=True)
+            await self._server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body = b""
+                if "content-length" in headers:
+                    body = await reader.readexactly(int(headers["content-length"]))
+
+                parts = urlsplit(target)
+                self.requests += 1
+                result = self.handler(method, parts.path, parse_qs(parts.query), body, headers)
+                if asyncio.iscoroutine(result):
+                    result = await result
+                status, payload = result
+                data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+
+GEMINI_SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+
+
+class GeminiStandInServer:
+    """Gemini API の GenerateContent / StreamGenerateContent を受ける gRPC サーバー。
+
+    service は generate_content() -> str と、文字列を順に返す stream_generate_content() を持つオブジェクト
+    (fakes.FakeGeminiService)。service が例外を送出した場合は INTERNAL エラーを返す。
+    アプリ側は GEMINI_API_ENDPOINT に endpoint を指定して接続する。
+    """
+
+    def __init__(self, service, host: str = "127.0.0.1", port: int = 0):
+        self.service = service
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self._server = None
+
+    @property
+    def endpoint(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    async def start(self) -> "GeminiStandInServer":
+        # HTTP の代替だけを使うベンチマークでは gRPC と proto を読み込まないようにします
+        import grpc
+        from google.ai import generativelanguage_v1beta as glm
+
+        def response(text: str, finished: bool) -> glm.GenerateContentResponse:
+            finish_reason = glm.Candidate.FinishReason.STOP if finished else glm.Candidate.FinishReason.FINISH_REASON_UNSPECIFIED
+            content = glm.Content(role="model", parts=[glm.Part(text=text)])
+            return glm.GenerateContentResponse(candidates=[glm.Candidate(index=0, content=content, finish_reason=finish_reason)])
+
+        async def generate_content(request, context):
+            self.requests += 1
+            try:
+                text = await self.service.generate_content()
+            except Exception as e:
+                await context.abort(grpc.StatusCode.INTERNAL, str(e))
+            return response(text, True)
+
+        async def stream_generate_content(request, context):
+            self.requests += 1
+            # 本物と同じく最後のチャンクに finish_reason を付けるので、1つ先まで読んでから送ります
+            previous = None
+            try:
+                async for text in self.service.stream_generate_content():
+                    if previous is not None:
+                        yield response(previous, False)
+                    previous = text
+            except Exception as e:
+                await context.abort(grpc.StatusCode.INTERNAL, str(e))
+            if previous is not None:
+                yield response(previous, True)
+
+        handler = grpc.method_handlers_generic_handler(GEMINI_SERVICE, {
+            "GenerateContent": grpc.unary_unary_rpc_method_handler(
+                generate_content,
+                request_deserializer=glm.GenerateContentRequest.deserialize,
+                response_serializer=glm.GenerateContentResponse.serialize,
+            ),
+            "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(
+                stream_generate_content,
+                request_deserializer=glm.GenerateContentRequest.deserialize,
+                response_serializer=glm.GenerateContentResponse.serialize,
+            ),
+        })
+        self._server = grpc.aio.server()
+        self._server.add_generic_rpc_handlers((handler,))
+        self.port = self._server.add_insecure_port(self.endpoint)
+        await self._server.start()
+        return self
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            await self._server.stop(grace=None)
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
@@ -0,0 +1,152 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import cache
+from cache import LRUCache, SingleFlight, normalize_place_name
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_lru_returns_cached_values_including_none(clock):
+    lru = LRUCache(4)
+    lru.set("a", None, 2000.0)
+    assert lru.get("a") == (True, None)
+    assert lru.get("b") == (False, None)
+
+
+def test_lru_expires_entries(clock):
+    lru = LRUCache(4)
+    lru.set("a", 1, 1010.0)
+    clock[0] = 1009.9
+    assert lru.get("a") == (True, 1)
+    clock[0] = 1010.0
+    assert lru.get("a") == (False, None)
+    # 期限切れの項目は読んだ時点で捨てます
+    assert len(lru) == 0
+
+
+def test_lru_evicts_least_recently_used(clock):
+    lru = LRUCache(2)
+    lru.set("a", 1, 2000.0)
+    lru.set("b", 2, 2000.0)
+    lru.get("a")
+    lru.set("c", 3, 2000.0)
+    assert lru.get("b") == (False, None)
+    assert lru.get("a") == (True, 1)
+    assert lru.get("c") == (True, 3)
+    assert len(lru) == 2
+
+
+def test_normalize_place_name():
+    assert normalize_place_name("  Ｔｏｋｙｏ　 Tower ") == "tokyo tower"
+
+
+def test_single_flight_shares_one_task_and_removes_the_key():
+    calls = []
+
+    async def fetch(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return key.upper()
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(asyncio.shield(flight.run("a", lambda: fetch("a"))) for _ in range(5)))
+        assert results == ["A"] * 5
+        assert calls == ["a"]
+        assert len(flight) == 0
+        assert flight.get("a") is None
+
+    asyncio.run(main())
+
+
+def test_single_flight_registers_every_key_of_a_shared_task():
+    async def main():
+        flight = SingleFlight()
+        task = flight.start(["a", "b"], lambda: asyncio.sleep(0.01, "done"))
+        assert flight.get("a") is task and flight.get("b") is task
+        assert flight.run("b", lambda: asyncio.sleep(0, "other")) is task
+        assert await task == "done"
+        await asyncio.sleep(0)
+        assert len(flight) == 0
+
+    asyncio.run(main())
+
+
+def test_single_flight_reports_errors_and_clears_keys():
+    errors = []
+
+    async def fail():
+        raise ValueError("boom")
+
+    async def main():
+        flight = SingleFlight(on_error=lambda key, e: errors.append((key, str(e))))
+        task = flight.start(["a", "b"], fail)
+        with pytest.raises(ValueError):
+            await asyncio.shield(task)
+        await asyncio.sleep(0)
+        assert len(flight) == 0
+        # 失敗した後は新しいタスクで取り直します
+        assert await flight.run("a", lambda: asyncio.sleep(0, "ok")) == "ok"
+
+    asyncio.run(main())
+    assert errors == [("a", "boom"), ("b", "boom")]
+
+
+def test_single_flight_keeps_running_when_a_caller_is_cancelled():
+    async def main():
+        flight = SingleFlight()
+        task = flight.run("a", lambda: asyncio.sleep(0.02, "done"))
+        waiter = asyncio.ensure_future(asyncio.shield(task))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        assert await task == "done"
+        assert waiter.cancelled()
+
+    asyncio.run(main())
+
+
+def test_single_flight_aclose_cancels_pending_tasks():
+    async def main():
+        flight = SingleFlight()
+        task = flight.run("a", lambda: asyncio.sleep(10))
+        await flight.aclose()
+        assert task.cancelled()
+        assert len(flight) == 0
+
+    asyncio.run(main())
+
+
+def test_single_flight_ignores_tasks_left_on_a_closed_loop():
+    flight = SingleFlight()
+    # 呼び出しの後にループを閉じるだけの ASGI ブリッジでは、裏で動いていたタスクが残ります
+    loop = asyncio.new_event_loop()
+
+    async def leave_pending():
+        flight.run("a", lambda: asyncio.sleep(10))
+
+    loop.run_until_complete(leave_pending())
+    stale = flight._tasks["a"]
+    # 閉じたループのタスクが破棄されるときの警告は、この状況では想定どおりなので出しません
+    stale._log_destroy_pending = False
+    loop.close()
+
+    async def main():
+        assert flight.get("a") is None
+        result = await asyncio.shield(flight.run("a", lambda: asyncio.sleep(0, "fresh")))
+        await flight.aclose()
+        return result
+
+    assert asyncio.run(main()) == "fresh"
+    assert not stale.done()
+    assert len(flight) == 0
@@ -0,0 +1,83 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+from geocoding import Geocoder, SQLiteStore, TokenBucket, is_read_only, normalize_place_name
+
+
+def elapsed(bucket: TokenBucket, count: int) -> float:
+    async def run():
+        started = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(count)))
+        return time.monotonic() - started
+
+    return asyncio.run(run())
+
+
+def test_token_bucket_limits_the_rate():
+    # 最初の1回はすぐ、残り4回は 1/20 秒ずつ
+    assert 0.18 <= elapsed(TokenBucket(20, 1), 5) < 0.5
+
+
+def test_token_bucket_allows_a_burst_of_capacity():
+    assert elapsed(TokenBucket(10, 3), 3) < 0.05
+
+
+def test_token_bucket_works_across_event_loops():
+    bucket = TokenBucket(20, 1)
+    elapsed(bucket, 3)
+    # 呼び出しごとに新しいループで動かす ASGI ブリッジと同じ状況
+    assert elapsed(bucket, 3) >= 0.09
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self._data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+class FakeNominatim:
+    def __init__(self):
+        self.queries = []
+
+    async def get(self, path, params=None):
+        self.queries.append(params["q"])
+        return FakeResponse([{"lat": "35.0", "lon": "139.0"}])
+
+
+def test_read_only_store_serves_a_shipped_cache_without_writing(tmp_path):
+    path = str(tmp_path / "geocode.sqlite3")
+    store = SQLiteStore(path)
+    store.set("浅草寺", {"lat": 35.7148, "lon": 139.7967}, time.time() + 3600)
+    store.close()
+    size = os.path.getsize(path)
+
+    nominatim = FakeNominatim()
+    geocoder = Geocoder(lambda: nominatim, store_path=path, rate=1000)
+    geocoder.store = SQLiteStore(path, readonly=True)
+
+    async def run():
+        return await geocoder.geocode("浅草寺"), await geocoder.geocode("東京タワー"), await geocoder.geocode("東京タワー")
+
+    shipped, looked_up, cached = asyncio.run(run())
+    geocoder.close()
+    assert shipped == {"lat": 35.7148, "lon": 139.7967}
+    assert looked_up == cached == {"lat": 35.0, "lon": 139.0}
+    # 新しい地名は LRU にだけ載り、ファイルには書きません
+    assert nominatim.queries == ["東京タワー, 日本"]
+    assert os.path.getsize(path) == size
+    reader = SQLiteStore(path)
+    assert reader.get(normalize_place_name("東京タワー"))[0] is False
+    reader.close()
+
+
+def test_missing_store_file_is_writable(tmp_path):
+    assert not is_read_only(str(tmp_path / "new.sqlite3"))
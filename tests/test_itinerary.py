@@ -0,0 +1,62 @@
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import index
+
+PLACES = {"浅草寺": {"lat": 35.7148, "lon": 139.7967}, "東京スカイツリー": {"lat": 35.7101, "lon": 139.8107}}
+
+
+def driving_table(request: httpx.Request) -> httpx.Response:
+    # 2地点間は車で 5分・1.5km。徒歩の見積もりは 1.5km / 分速80m ≒ 19分
+    size = request.url.path.rsplit("/", 1)[-1].count(";") + 1
+    durations = [[0 if i == j else 300 for j in range(size)] for i in range(size)]
+    distances = [[0 if i == j else 1500 for j in range(size)] for i in range(size)]
+    return httpx.Response(200, json={"code": "Ok", "durations": durations, "distances": distances})
+
+
+def failing_walking(request: httpx.Request) -> httpx.Response:
+    raise httpx.ConnectTimeout("timed out", request=request)
+
+
+def unavailable_walking(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(502, json={"message": "bad gateway"})
+
+
+@pytest.fixture
+def itinerary(monkeypatch):
+    def use(walking_handler):
+        clients = {
+            "osrm": httpx.AsyncClient(base_url="http://osrm.test", transport=httpx.MockTransport(driving_table)),
+            "osrm_walking": httpx.AsyncClient(base_url="http://foot.test", transport=httpx.MockTransport(walking_handler)),
+        }
+        monkeypatch.setattr(index, "get_client", clients.__getitem__)
+
+        async def geocode(name):
+            return PLACES.get(name)
+
+        async def forecast(*args, **kwargs):
+            return {"daily": {"temperature_2m_max": [25.0], "precipitation_probability_max": [10]}}
+
+        monkeypatch.setattr(index.geocoder, "geocode", geocode)
+        monkeypatch.setattr(index.forecast_cache, "get", forecast)
+        return asyncio.run(index.plan_itinerary("浅草寺,東京スカイツリー", "2025-09-10", "60,30", 35.681, 139.767, "09:00"))
+
+    return use
+
+
+@pytest.mark.parametrize("walking_handler", [failing_walking, unavailable_walking])
+def test_itinerary_falls_back_to_driving_distances_when_walking_matrix_fails(itinerary, walking_handler, caplog):
+    result = itinerary(walking_handler)
+    assert isinstance(result, dict)
+    steps = result["plan"]
+    assert steps[0]["place"] == "現在地"
+    assert sorted(step["place"] for step in steps[1:]) == sorted(PLACES)
+    # 徒歩の見積もり (19分) は車 + 駐車 (15分) より遅く、15分も超えるので車になります
+    assert [(step["transportation"], step["travel_time"]) for step in steps[1:]] == [("車", "15分"), ("車", "15分")]
+    assert "Walking matrix unavailable" in caplog.text
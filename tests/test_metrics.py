@@ -0,0 +1,109 @@
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import metrics
+from metrics import REQUEST_LATENCY, Counter, Histogram, MetricsMiddleware, server_timing, stage
+
+
+@pytest.fixture
+def registry():
+    # テスト用のメトリクスは /metrics に残さないようにします
+    before = list(metrics.REGISTRY)
+    yield
+    metrics.REGISTRY[:] = before
+
+
+def test_counter_renders_total_name_and_escapes_labels(registry):
+    counter = Counter("test_events", "Events seen by the test.", ("kind",))
+    counter.inc(kind='say "hi"\\\n')
+    counter.inc(2, kind="plain")
+    assert counter.render() == [
+        "# HELP final_app_test_events_total Events seen by the test.",
+        "# TYPE final_app_test_events_total counter",
+        'final_app_test_events_total{kind="plain"} 2',
+        'final_app_test_events_total{kind="say \\"hi\\"\\\\\\n"} 1',
+    ]
+
+
+def test_histogram_renders_cumulative_buckets(registry):
+    histogram = Histogram("test_seconds", "Durations seen by the test.", ("stage",), buckets=(0.5, 1.0))
+    for value in (0.25, 0.5, 0.75, 2.0):
+        histogram.observe(value, stage="a")
+    histogram.observe(0.1, stage="b")
+    assert histogram.render() == [
+        "# HELP final_app_test_seconds Durations seen by the test.",
+        "# TYPE final_app_test_seconds histogram",
+        # 境界と同じ値はそのバケットに入ります
+        'final_app_test_seconds_bucket{stage="a",le="0.5"} 2',
+        'final_app_test_seconds_bucket{stage="a",le="1.0"} 3',
+        'final_app_test_seconds_bucket{stage="a",le="+Inf"} 4',
+        'final_app_test_seconds_sum{stage="a"} 3.5',
+        'final_app_test_seconds_count{stage="a"} 4',
+        'final_app_test_seconds_bucket{stage="b",le="0.5"} 1',
+        'final_app_test_seconds_bucket{stage="b",le="1.0"} 1',
+        'final_app_test_seconds_bucket{stage="b",le="+Inf"} 1',
+        'final_app_test_seconds_sum{stage="b"} 0.1',
+        'final_app_test_seconds_count{stage="b"} 1',
+    ]
+
+
+def test_render_joins_every_metric(registry):
+    metrics.REGISTRY[:] = []
+    Counter("test_empty", "Nothing counted yet.")
+    assert metrics.render() == (
+        "# HELP final_app_test_empty_total Nothing counted yet.\n"
+        "# TYPE final_app_test_empty_total counter\n"
+    )
+
+
+def test_server_timing_merges_repeated_stages():
+    timings = [("geocode", 0.0123), ("matrix", 0.1), ("matrix", 0.05)]
+    assert server_timing(timings, 0.2) == 'geocode;dur=12.3, matrix;dur=150.0;desc="2 calls", total;dur=200.0'
+
+
+def test_stage_counts_errors():
+    before = metrics.ERRORS._values.get(("test_stage", "KeyError"), 0)
+    with pytest.raises(KeyError):
+        with stage("test_stage"):
+            raise KeyError("missing")
+    assert metrics.ERRORS._values[("test_stage", "KeyError")] == before + 1
+
+
+def test_middleware_labels_requests_by_route_template():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: int):
+        with stage("lookup"):
+            return {"id": item_id}
+
+    def count(route: str, status: str) -> int:
+        value = REQUEST_LATENCY._values.get(("GET", route, status))
+        return 0 if value is None else value[2]
+
+    before_item, before_unmatched = count("/items/{item_id}", "200"), count("unmatched", "404")
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app.test") as client:
+            response = await client.get("/items/42")
+            await client.get("/items/43")
+            await client.get("/no/such/path")
+            return response
+
+    response = asyncio.run(run())
+
+    assert response.json() == {"id": 42}
+    server_timing_header = response.headers["server-timing"]
+    assert server_timing_header.startswith("lookup;dur=")
+    assert ", total;dur=" in server_timing_header
+    # パスの値ごとではなく、ルートのテンプレートでまとめて数えます
+    assert count("/items/{item_id}", "200") == before_item + 2
+    assert count("unmatched", "404") == before_unmatched + 1
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+from parking_index import ParkingIndex, build_snapshot, haversine_m, tile_bounds, tile_for, tiles_covering, tiles_within
+
+TOKYO_STATION = (35.681236, 139.767125)
+OSAKA_STATION = (34.702485, 135.495951)
+
+
+def test_tile_for_known_coordinates():
+    assert tile_for(0.0, 0.0, zoom=1) == (1, 1)
+    assert tile_for(*TOKYO_STATION) == (14552, 6451)
+    # 端の緯度経度はタイル番号の範囲内に収めます
+    assert tile_for(89.9, 180.0, zoom=2) == (3, 0)
+
+
+def test_tile_bounds_contain_the_point():
+    south, west, north, east = tile_bounds(*tile_for(*TOKYO_STATION))
+    assert south <= TOKYO_STATION[0] <= north
+    assert west <= TOKYO_STATION[1] <= east
+    assert east - west == pytest.approx(360 / (1 << 14))
+
+
+def test_tiles_covering():
+    assert tiles_covering(*TOKYO_STATION, radius_m=10) == [tile_for(*TOKYO_STATION)]
+    tiles = tiles_covering(*TOKYO_STATION, radius_m=3000)
+    # 直径6km は zoom 14 のタイル (約2km四方) 4枚分程度の幅です
+    assert len(tiles) == 16
+    assert tile_for(*TOKYO_STATION) in tiles
+
+
+def test_haversine_m():
+    one_degree = haversine_m(0.0, 0.0, np.array([1.0, 0.0]), np.array([0.0, 1.0]))
+    assert one_degree == pytest.approx([111195.08, 111195.08], rel=1e-6)
+    assert haversine_m(*TOKYO_STATION, np.array([OSAKA_STATION[0]]), np.array([OSAKA_STATION[1]]))[0] == pytest.approx(403058, abs=1)
+
+
+def test_build_snapshot_keeps_only_tiles_inside_the_bbox():
+    bbox = (35.60, 139.65, 35.75, 139.85)
+    inside = tiles_within(*bbox)
+    elements = [
+        {"type": "node", "id": 1, "lat": TOKYO_STATION[0], "lon": TOKYO_STATION[1], "tags": {"name": "東京駅P"}},
+        # 同じ要素が重複していても1件にします
+        {"type": "node", "id": 1, "lat": TOKYO_STATION[0], "lon": TOKYO_STATION[1], "tags": {"name": "東京駅P"}},
+        {"type": "way", "id": 2, "center": {"lat": 35.70, "lon": 139.80}},
+        # 境界に掛かるタイルは含めません
+        {"type": "node", "id": 3, "lat": 35.6001, "lon": 139.6501},
+    ]
+    snapshot = build_snapshot(elements, bbox)
+    assert snapshot["zoom"] == 14
+    assert snapshot["tiles"] == sorted(inside)
+    assert all(bbox[0] <= s and n <= bbox[2] for s, _, n, _ in (tile_bounds(*tile) for tile in inside))
+    assert snapshot["lots"] == [["node/1", "東京駅P", *TOKYO_STATION], ["way/2", "名称不明", 35.70, 139.80]]
+
+
+class NoOverpass:
+    def get(self, *args, **kwargs):
+        raise AssertionError("snapshot tiles must not be fetched from Overpass")
+
+
+def test_snapshot_larger_than_the_tile_cache_is_served_without_overpass(tmp_path):
+    bbox = (35.60, 139.65, 35.75, 139.85)
+    elements = [{"type": "node", "id": 1, "lat": TOKYO_STATION[0], "lon": TOKYO_STATION[1], "tags": {"name": "東京駅P"}}]
+    snapshot = build_snapshot(elements, bbox)
+    assert len(snapshot["tiles"]) > 4
+    path = tmp_path / "parking.json"
+    path.write_text(json.dumps(snapshot), encoding="utf-8")
+
+    index = ParkingIndex(lambda: NoOverpass(), maxsize=4, snapshot_path=str(path))
+
+    async def run():
+        # 同時に来たリクエストも、スナップショットの読み込みを待ってから検索します
+        return await asyncio.gather(
+            index.nearby(*TOKYO_STATION, radius_m=500),
+            index.nearby(35.70, 139.70, radius_m=3000),
+        )
+
+    near_station, elsewhere = asyncio.run(run())
+    assert near_station == [{"name": "東京駅P", "lat": TOKYO_STATION[0], "lon": TOKYO_STATION[1], "distance_m": 0}]
+    # 新宿寄りの16タイルもすべてスナップショットから答えます (東京駅は半径の外)
+    assert elsewhere == []
@@ -0,0 +1,66 @@
+import itertools
+import math
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+from route_optimizer import RouteError, _to_matrix, held_karp, leg_costs, local_search, path_cost, walking_matrix
+
+
+def random_durations(rng: random.Random, size: int, unreachable: float = 0.0):
+    """OSRM の table と同じ形の非対称な所要時間行列。unreachable の割合で None (到達不能) を混ぜる。"""
+    return [
+        [0 if i == j else (None if rng.random() < unreachable else rng.randint(60, 3600)) for j in range(size)]
+        for i in range(size)
+    ]
+
+
+def brute_force(cost: np.ndarray) -> float:
+    n = cost.shape[0]
+    return min(path_cost(cost, (0, *order)) for order in itertools.permutations(range(1, n)))
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_held_karp_matches_brute_force(seed):
+    rng = random.Random(seed)
+    cost = _to_matrix(random_durations(rng, rng.randint(2, 7), unreachable=rng.choice([0.0, 0.0, 0.3])))
+    best = brute_force(cost)
+
+    if not math.isfinite(best):
+        with pytest.raises(RouteError):
+            held_karp(cost)
+        return
+    order = held_karp(cost)
+    assert order[0] == 0
+    assert sorted(order) == list(range(cost.shape[0]))
+    assert path_cost(cost, order) == pytest.approx(best)
+
+
+def test_held_karp_raises_when_a_destination_is_unreachable():
+    durations = [[0, 100, None], [100, 0, None], [None, None, 0]]
+    with pytest.raises(RouteError):
+        held_karp(_to_matrix(durations))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_local_search_returns_a_valid_route_no_better_than_optimal(seed):
+    rng = random.Random(seed)
+    cost = _to_matrix(random_durations(rng, 8))
+    order = local_search(cost)
+    assert order[0] == 0
+    assert sorted(order) == list(range(8))
+    assert path_cost(cost, order) >= brute_force(cost) - 1e-9
+
+
+def test_walking_is_estimated_from_distance_when_matrices_are_identical():
+    driving = [[0, 600], [600, 0]]
+    distances = [[0, 20000], [20000, 0]]
+    walk = walking_matrix(driving, driving, distances)
+    assert walk[0, 1] > 4 * 3600
+    _, use_walk = leg_costs(driving, driving, distances)
+    assert not use_walk[0, 1]
@@ -0,0 +1,95 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import uploads
+from uploads import Uploader
+
+
+class FakeFile:
+    """UploadFile の代わり。parts 個の part_size バイトのパートを返し、fail_at 回目の read で失敗する。"""
+
+    def __init__(self, parts: int, part_size: int, fail_at: int | None = None):
+        self.filename = "photo.jpg"
+        self.data = b"x" * (parts * part_size)
+        self.position = 0
+        self.reads = 0
+        self.fail_at = fail_at
+
+    async def seek(self, position: int) -> None:
+        self.position = position
+
+    async def read(self, size: int = -1) -> bytes:
+        self.reads += 1
+        if self.reads == self.fail_at:
+            raise OSError("read failed")
+        end = len(self.data) if size < 0 else self.position + size
+        chunk = self.data[self.position:end]
+        self.position += len(chunk)
+        return chunk
+
+
+@pytest.fixture
+def blob(monkeypatch):
+    calls = {"parts": 0}
+
+    def upload_part(pathname, upload_id, key, part_number, data, headers, options):
+        calls["parts"] += 1
+        time.sleep(0.01)
+        return {"partNumber": part_number, "etag": f"etag-{part_number}"}
+
+    monkeypatch.setenv("BLOB_READ_WRITE_TOKEN", "vercel_blob_rw_store_token")
+    monkeypatch.setattr(uploads, "find_blob", lambda pathname: None)
+    monkeypatch.setattr(uploads, "put_small", lambda pathname, data: {"url": f"https://blob.test/{pathname}"})
+    monkeypatch.setattr(uploads.blob_store, "_create_multipart_upload", lambda *args: {"uploadId": "upload", "key": "key"})
+    monkeypatch.setattr(uploads.blob_store, "_upload_part", upload_part)
+    monkeypatch.setattr(uploads.blob_store, "_complete_multipart_upload", lambda pathname, *args: {"url": f"https://blob.test/{pathname}"})
+    return calls
+
+
+def test_multipart_upload_works_from_a_new_event_loop(blob):
+    uploader = Uploader(part_size=4, multipart_threshold=0, part_concurrency=1)
+
+    async def upload():
+        # 1枠を複数のパートで取り合うので、セマフォが待たされる状況になります
+        result = await uploader._upload_multipart(FakeFile(3, 4), "images/a.jpg")
+        return result, uploader._slots._value
+
+    # 呼び出しごとに新しいループで動かす ASGI ブリッジと同じ状況
+    assert asyncio.run(upload()) == ({"url": "https://blob.test/images/a.jpg"}, 1)
+    assert asyncio.run(upload()) == ({"url": "https://blob.test/images/a.jpg"}, 1)
+    assert blob["parts"] == 6
+    uploader.shutdown()
+
+
+def test_read_failure_releases_every_slot(blob):
+    uploader = Uploader(part_size=4, multipart_threshold=0, part_concurrency=2)
+
+    async def upload():
+        with pytest.raises(OSError):
+            await uploader._upload_multipart(FakeFile(3, 4, fail_at=2), "images/a.jpg")
+        # 失敗したパートの後始末 (キャンセルされたタスクの完了) を待ちます
+        await asyncio.sleep(0.05)
+        return uploader._slots._value
+
+    assert asyncio.run(upload()) == 2
+    uploader.shutdown()
+
+
+def test_concurrent_identical_uploads_are_deduplicated(blob):
+    uploader = Uploader(multipart_threshold=1024)
+
+    async def upload():
+        return await asyncio.gather(*(uploader.upload(FakeFile(1, 16)) for _ in range(3)))
+
+    results = asyncio.run(upload())
+    assert sorted(result["deduplicated"] for result in results) == [False, True, True]
+    assert len({result["url"] for result in results}) == 1
+    # 完了後は LRU から返します
+    assert asyncio.run(uploader.upload(FakeFile(1, 16)))["deduplicated"] is True
+    uploader.shutdown()
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import sys
+import threading
+from dataclasses import replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+from upstream import UPSTREAMS, UpstreamPool
+
+
+def test_pool_keeps_one_client_per_event_loop():
+    pool = UpstreamPool({"osrm": UPSTREAMS["osrm"]})
+
+    async def use():
+        client = pool.client("osrm")
+        assert pool.client("osrm") is client
+        return client
+
+    first = asyncio.run(use())
+
+    async def use_from_new_loop():
+        client = await use()
+        # 古いクライアントは新しいループ上のタスクで閉じます
+        await asyncio.gather(*pool._closing)
+        return client
+
+    second = asyncio.run(use_from_new_loop())
+    assert second is not first
+    assert first.is_closed
+    assert not second.is_closed
+    assert pool._clients == {"osrm": second}
+    assert not pool._closing
+    asyncio.run(pool.aclose())
+    assert second.is_closed
+
+
+class OkHandler(BaseHTTPRequestHandler):
+    # keep-alive の接続を残すため HTTP/1.1 で応答します
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+def test_stale_client_with_open_connections_is_released():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        base_url = f"http://127.0.0.1:{server.server_port}"
+        pool = UpstreamPool({"osrm": replace(UPSTREAMS["osrm"], base_url=base_url)})
+
+        async def request():
+            client = pool.client("osrm")
+            (await client.get("/")).raise_for_status()
+            return client
+
+        first = asyncio.run(request())
+        assert len(first._transport._transport._pool.connections) == 1
+
+        async def request_from_new_loop():
+            client = await request()
+            await asyncio.gather(*pool._closing)
+            return client
+
+        asyncio.run(request_from_new_loop())
+        assert first.is_closed
+        # 元のループが閉じていても、古い接続はプールから外れています
+        assert first._transport._transport._pool.connections == []
+    finally:
+        server.shutdown()
+        server.server_close()